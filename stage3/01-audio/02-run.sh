@@ -12,6 +12,8 @@ install -D -m 644 -t "${ROOTFS_DIR}/lib/systemd/system" "files/raspotify@.servic
 install -D -m 644 "files/raspotify.conf" "${ROOTFS_DIR}/etc/raspotify/conf"
 install -D -m 644 "files/raspotify-default.conf" "${ROOTFS_DIR}/etc/raspotify/default.conf"
 
-install -D -m 644 -t "${ROOTFS_DIR}/usr/share/snapserver/plug-ins" "files/meta_librespot.py" "files/onevent_fifo.py"
+install -D -m 644 -t "${ROOTFS_DIR}/usr/share/snapserver/plug-ins" "files/meta_librespot.py" "files/meta_cache.py" "files/meta_metrics.py" "files/onevent_fifo.py" "files/onevent_journal.py"
+install -D -m 755 -t "${ROOTFS_DIR}/usr/share/snapserver/plug-ins" "files/onevent_hook.sh" "files/onevent_forwarder.py" "files/onevent_bus.py"
+install -D -m 644 -t "${ROOTFS_DIR}/lib/systemd/system" "files/onevent-forwarder@.service"
 
 cp -r "files/spotipy" "${ROOTFS_DIR}/usr/lib/python3/dist-packages/"
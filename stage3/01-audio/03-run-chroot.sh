@@ -27,6 +27,8 @@ wget -nc "https://github.com/badaix/snapcast/releases/download/v${SNAPCAST_VERSI
 apt install --yes "./${SNAPSERVER}"
 rm -f "${SNAPSERVER}"
 
+install -m 755 -o snapserver -g snapserver -d /var/cache/snapserver/meta_librespot
+
 systemctl disable snapserver.service
 
 SNAPCLIENT=snapclient_${SNAPCAST_VERSION}-1_${ARCH}_${RELEASE}.deb
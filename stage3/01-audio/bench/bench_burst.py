@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import select
+import argparse
+import itertools
+import tempfile
+import threading
+import statistics
+import subprocess
+
+# Every burst numbers its messages from its own offset, so that late answers to a previous burst are told apart
+offsets = itertools.count(0, 1 << 20)
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+PLUGIN = os.path.join(FILES_DIR, "meta_librespot.py")
+
+def percentile(values, p):
+    """
+    Returns a percentile of a list of values, using the nearest rank.
+
+    Args:
+        values (list): The values.
+        p (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The value below which p percent of the values fall.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def collect(fd, predicate, timeout):
+    """
+    Reads the messages the plugin writes to its standard output and timestamps them, until one matches a predicate.
+
+    Args:
+        fd (int): The file descriptor of the standard output of the plugin.
+        predicate (callable): Returns True for the message to wait for.
+        timeout (float): How long to wait, in seconds.
+
+    Returns:
+        list: The (receive time, message) tuples received.
+    """
+    deadline = time.monotonic() + timeout
+    received = []
+    buffer = b""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            return received
+        chunk = os.read(fd, 1 << 20)
+        t = time.perf_counter()
+        if not chunk:
+            return received
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            message = json.loads(line)
+            received.append((t, message))
+            if predicate(message):
+                return received
+
+def track_changed(index, ts):
+    """
+    Returns a track_changed event for a burst, the index of the event is its track ID.
+    """
+    return {
+        "event": "track_changed", "track_id": str(index), "uri": f"spotify:track:{index}", "name": f"Track {index}",
+        "duration_ms": 213573, "album": "Album", "artists": ["Artist"], "album_artists": ["Artist"],
+        "covers": ["https://i.scdn.co/image/0"], "ts": ts
+    }
+
+def burst(plugin, fifo_path, source, count, timeout=5.0):
+    """
+    Sends a burst of messages to the plugin at once and measures how long each one takes to be answered.
+
+    The latency of a librespot event is the time until the first notification reflecting it (or a later
+    event of the burst) is received, the plugin may fold several events into one notification.
+
+    Args:
+        plugin (subprocess.Popen): The plugin.
+        fifo_path (str): The file system path to the named pipe of the plugin.
+        source (str): "fifo" for librespot track_changed events, "stdin" for Snapcast GetProperties requests.
+        count (int): The number of messages in the burst.
+        timeout (float): How long to wait for the answers, in seconds.
+
+    Returns:
+        dict: The number of messages answered within the timeout, the total time of the burst and the latency percentiles, in milliseconds.
+    """
+    offset = next(offsets)
+    if source == "fifo":
+        base = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+        data = "".join(json.dumps(track_changed(offset + i, base + i)) + "\n" for i in range(count))
+        # The index of the last event reflected by a message, or None
+        answered = lambda m: int(m["params"]["metadata"]["trackId"]) - offset if "metadata" in m.get("params", {}) and m.get("method") == "Plugin.Stream.Player.Properties" else None
+        fd = os.open(fifo_path, os.O_WRONLY)
+    else:
+        data = "".join(json.dumps({"id": offset + i, "jsonrpc": "2.0", "method": "Plugin.Stream.Player.GetProperties"}) + "\n" for i in range(count))
+        answered = lambda m: m["id"] - offset if "result" in m else None
+        fd = plugin.stdin.fileno()
+
+    # The burst may not fit in the pipe, it is written by another thread while the answers are read
+    def write():
+        os.write(fd, data.encode())
+        if source == "fifo":
+            os.close(fd)
+
+    writer = threading.Thread(target=write)
+    start = time.perf_counter()
+    writer.start()
+    messages = collect(plugin.stdout.fileno(), lambda m: answered(m) == count - 1, timeout)
+    writer.join()
+
+    # Messages left unanswered, e.g. stuck in a read buffer until the next wakeup, count as timed out
+    latencies = [timeout * 1000.0] * count
+    done = 0
+    for t, m in messages:
+        index = answered(m)
+        if index is None or not 0 <= index < count:
+            continue
+        while done <= index:
+            latencies[done] = (t - start) * 1000.0
+            done += 1
+    return {"answered": done, "total": max(latencies), "p50": percentile(latencies, 50), "p99": percentile(latencies, 99)}
+
+def measure(sources, count, repeat):
+    """
+    Starts meta_librespot.py against a private named pipe and measures its burst handling.
+
+    Args:
+        sources (list): The sources to send bursts on, "fifo" and/or "stdin".
+        count (int): The number of messages per burst.
+        repeat (int): The number of bursts per source, the median is reported.
+
+    Returns:
+        dict: The results of each source.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fifo_path = os.path.join(tmp_dir, "spotfifo")
+        plugin = subprocess.Popen(
+            [sys.executable, PLUGIN, "--config", os.path.join(tmp_dir, "none.conf"), "--librespot-fifo", fifo_path,
+             "--librespot-journal", os.path.join(tmp_dir, "journal")],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        try:
+            ready = collect(plugin.stdout.fileno(), lambda m: m.get("method") == "Plugin.Stream.Ready", 60.0)
+            if not ready or ready[-1][1].get("method") != "Plugin.Stream.Ready":
+                raise RuntimeError(f"Unexpected messages from plugin: {ready}")
+            # Let the plugin replay its (empty) journal
+            collect(plugin.stdout.fileno(), lambda m: False, 0.5)
+
+            for source in sources:
+                runs = [burst(plugin, fifo_path, source, count) for _ in range(repeat)]
+                results[source] = {key: statistics.median(r[key] for r in runs) for key in ("answered", "total", "p50", "p99")}
+        finally:
+            plugin.terminate()
+            plugin.wait()
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), description="Measure how meta_librespot.py handles bursts of librespot events and Snapcast requests.")
+
+    parser.add_argument('-n', '--count', type=int, default=500, help='Set the number of messages per burst (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Set the number of bursts per source (default: %(default)s)')
+    parser.add_argument('--sources', default="fifo,stdin", help='Set the comma-separated sources to send bursts on (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE', help='Also write the results to a JSON file, for comparison between versions')
+
+    args = parser.parse_args()
+
+    results = measure(args.sources.split(","), args.count, args.repeat)
+
+    print(f"{'source':<8} {'answered':>8} {'total ms':>9} {'msg/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for source, r in results.items():
+        print(f"{source:<8} {int(r['answered']):8d} {r['total']:9.2f} {r['answered'] / r['total'] * 1000.0:8.0f} {r['p50']:8.2f} {r['p99']:8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
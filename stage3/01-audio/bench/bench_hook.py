@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import zipapp
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import py_compile
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+
+MODULES = ("onevent_fifo.py", "onevent_bus.py", "onevent_journal.py")
+
+COVERS = "\n".join(f"https://i.scdn.co/image/ab67616d0000{size:04x}0123456789abcdef01234567" for size in (0x4851, 0x1e02, 0xb273))
+
+# Environments librespot passes to the hook, one per player event
+EVENTS = {
+    "volume_changed": {"PLAYER_EVENT": "volume_changed", "VOLUME": "32768"},
+    "playing": {"PLAYER_EVENT": "playing", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC", "POSITION_MS": "61234"},
+    "paused": {"PLAYER_EVENT": "paused", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC", "POSITION_MS": "61234"},
+    "seeked": {"PLAYER_EVENT": "seeked", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC", "POSITION_MS": "120000"},
+    "position_correction": {"PLAYER_EVENT": "position_correction", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC", "POSITION_MS": "120250"},
+    "unavailable": {"PLAYER_EVENT": "unavailable", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC"},
+    "end_of_track": {"PLAYER_EVENT": "end_of_track", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC"},
+    "preload_next": {"PLAYER_EVENT": "preload_next", "TRACK_ID": "7GhIk7Il098yCjg4BQjzvb"},
+    "preloading": {"PLAYER_EVENT": "preloading", "TRACK_ID": "7GhIk7Il098yCjg4BQjzvb"},
+    "loading": {"PLAYER_EVENT": "loading", "TRACK_ID": "7GhIk7Il098yCjg4BQjzvb", "POSITION_MS": "0"},
+    "stopped": {"PLAYER_EVENT": "stopped", "TRACK_ID": "7GhIk7Il098yCjg4BQjzvb"},
+    "shuffle_changed": {"PLAYER_EVENT": "shuffle_changed", "SHUFFLE": "true"},
+    "repeat_changed": {"PLAYER_EVENT": "repeat_changed", "REPEAT": "true", "REPEAT_TRACK": "false"},
+    "session_connected": {"PLAYER_EVENT": "session_connected", "USER_NAME": "rick", "CONNECTION_ID": "a1b2c3d4"},
+    "track_changed": {
+        "PLAYER_EVENT": "track_changed", "ITEM_TYPE": "Track", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC",
+        "URI": "spotify:track:4uLU6hMCjMI75M1A2tKUQC", "NAME": "Never Gonna Give You Up", "DURATION_MS": "213573",
+        "IS_EXPLICIT": "false", "LANGUAGE": "en", "COVERS": COVERS, "NUMBER": "1", "DISC_NUMBER": "1",
+        "POPULARITY": "78", "ALBUM": "Whenever You Need Somebody", "ARTISTS": "Rick Astley", "ALBUM_ARTISTS": "Rick Astley"
+    },
+    "episode_changed": {
+        "PLAYER_EVENT": "track_changed", "ITEM_TYPE": "Episode", "TRACK_ID": "512ojhOuo1ktJprKbVcKyQ",
+        "URI": "spotify:episode:512ojhOuo1ktJprKbVcKyQ", "NAME": "Episode 42", "DURATION_MS": "3601000",
+        "IS_EXPLICIT": "false", "LANGUAGE": "en", "COVERS": COVERS, "SHOW_NAME": "A podcast",
+        "PUBLISH_TIME": "1700000000", "DESCRIPTION": "Lorem ipsum dolor sit amet. " * 300
+    }
+}
+
+VARIANTS = ("source", "-S", "-I", "trimmed", "pyc", "zipapp", "hook", "fallback")
+
+# Stands in for the json module in the trimmed variant. Importing json imports json.decoder, and with it re,
+# enum and functools, while the hook only encodes events. The encoding matches json.dumps() with its defaults.
+TRIMMED_JSON = """
+from _json import encode_basestring_ascii
+
+def dumps(value):
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{dumps(str(key))}: {dumps(item)}" for key, item in value.items()) + "}"
+    return "[" + ", ".join(dumps(item) for item in value) + "]"
+
+def loads(data):
+    import json
+    return json.loads(data)
+"""
+
+def stage(python, build_dir):
+    """
+    Builds every variant of the hook in a scratch directory.
+
+    Args:
+        python (str): The interpreter to run the Python variants with.
+        build_dir (str): The directory to build the variants in.
+
+    Returns:
+        dict: The command line of each variant.
+    """
+    source_dir = os.path.join(build_dir, "source")
+    os.makedirs(source_dir)
+    for module in MODULES + ("onevent_hook.sh",):
+        shutil.copy(os.path.join(FILES_DIR, module), source_dir)
+
+    pyc_dir = os.path.join(build_dir, "pyc")
+    os.makedirs(pyc_dir)
+    for module in MODULES:
+        py_compile.compile(os.path.join(source_dir, module), os.path.join(pyc_dir, module + "c"), doraise=True)
+
+    # The same modules, but the hook imports a minimal JSON encoder rather than the json module
+    trimmed_dir = os.path.join(build_dir, "trimmed")
+    shutil.copytree(source_dir, trimmed_dir)
+    with open(os.path.join(trimmed_dir, "onevent_fifo.py")) as module:
+        source = module.read()
+    with open(os.path.join(trimmed_dir, "onevent_fifo.py"), "w") as module:
+        module.write(source.replace("\nimport json\n", "\nimport trimmed_json as json\n", 1))
+    with open(os.path.join(trimmed_dir, "trimmed_json.py"), "w") as module:
+        module.write(TRIMMED_JSON)
+
+    app_dir = os.path.join(build_dir, "app")
+    shutil.copytree(pyc_dir, app_dir)
+    with open(os.path.join(app_dir, "__main__.py"), "w") as main:
+        main.write("import onevent_fifo, sys\nif not onevent_fifo.dispatch(onevent_fifo.os.environ):\n    sys.exit(1)\n")
+    zipapp.create_archive(app_dir, os.path.join(build_dir, "onevent_fifo.pyz"))
+
+    script = os.path.join(source_dir, "onevent_fifo.py")
+    return {
+        "source": [python, script],
+        "-S": [python, "-S", script],
+        # -I does not put the script directory on sys.path, the hook modules have to be found explicitly
+        "-I": [python, "-I", "-c", f"import sys; sys.path.insert(0, {source_dir!r}); sys.argv[0] = {script!r}; exec(compile(open({script!r}).read(), {script!r}, 'exec'))"],
+        "trimmed": [python, "-S", os.path.join(trimmed_dir, "onevent_fifo.py")],
+        "pyc": [python, os.path.join(pyc_dir, "onevent_fifo.pyc")],
+        "zipapp": [python, "-I", os.path.join(build_dir, "onevent_fifo.pyz")],
+        "hook": ["/bin/sh", os.path.join(source_dir, "onevent_hook.sh")],
+        # The same hook when no forwarder is running, it runs onevent_fifo.py with /usr/bin/python3
+        "fallback": ["/bin/sh", os.path.join(source_dir, "onevent_hook.sh")]
+    }
+
+def drain(fifo_path, stop):
+    """
+    Reads and discards everything written to the named pipe, standing in for the snapserver plugin.
+
+    Args:
+        fifo_path (str): The file system path to the named pipe.
+        stop (threading.Event): Set to stop draining.
+    """
+    fd = os.open(fifo_path, os.O_RDWR)
+    try:
+        while not stop.is_set():
+            os.read(fd, 65536)
+    finally:
+        os.close(fd)
+
+# Runs the commands it reads on stdin and reports their resource usage. The peak RSS of a child
+# includes the memory of the process it was forked from, so the hook is forked from this small
+# process rather than from the benchmark itself.
+LAUNCHER = """
+import os, sys, json, time
+for line in sys.stdin:
+    request = json.loads(line)
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.execve(request["argv"][0], request["argv"], request["env"])
+    _, status, rusage = os.wait4(pid, 0)
+    wall = time.perf_counter() - start
+    print(json.dumps({"status": os.waitstatus_to_exitcode(status), "wall": wall * 1000.0, "user": rusage.ru_utime * 1000.0,
+                      "sys": rusage.ru_stime * 1000.0, "rss": rusage.ru_maxrss}), flush=True)
+"""
+
+def run(launcher, command, env):
+    """
+    Runs the hook once.
+
+    Args:
+        launcher (subprocess.Popen): The launcher process to run the hook from.
+        command (list): The command line of the hook.
+        env (dict): The environment of the hook.
+
+    Returns:
+        dict: The wall time, user and system CPU time in milliseconds, and the peak RSS in kilobytes.
+    """
+    launcher.stdin.write(json.dumps({"argv": command, "env": env}) + "\n")
+    launcher.stdin.flush()
+    result = json.loads(launcher.stdout.readline())
+    if result.pop("status") != 0:
+        raise RuntimeError(f"{' '.join(command)} failed")
+    return result
+
+def import_time(command, env):
+    """
+    Measures the time spent importing modules by the hook, using -X importtime.
+
+    Args:
+        command (list): The command line of the hook.
+        env (dict): The environment of the hook.
+
+    Returns:
+        float: The total import time, in milliseconds, or None for the shell hook.
+    """
+    if command[0] == "/bin/sh":
+        return None
+    result = subprocess.run(command[:1] + ["-X", "importtime"] + command[1:], env=env, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    total = 0
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_time = line.split(":", 1)[1].split("|")[0].strip()
+            if self_time.isdigit():
+                total += int(self_time)
+    return total / 1000.0
+
+def benchmark(python, variants, events, repeat):
+    """
+    Benchmarks every variant of the hook against every event.
+
+    Args:
+        python (str): The interpreter to run the hook with.
+        variants (list): The names of the variants to benchmark.
+        events (list): The names of the events to benchmark.
+        repeat (int): The number of runs of each variant and event, the median is reported.
+
+    Returns:
+        list: One result dictionary per variant and event.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        commands = stage(python, os.path.join(tmp_dir, "build"))
+
+        fifo_path = os.path.join(tmp_dir, "spotfifo")
+        os.mkfifo(fifo_path)
+        stop = threading.Event()
+        drainer = threading.Thread(target=drain, args=(fifo_path, stop), daemon=True)
+        drainer.start()
+
+        forwarder_path = os.path.join(tmp_dir, "forwarder")
+        forwarder = None
+        if "hook" in variants:
+            forwarder = subprocess.Popen([python, os.path.join(FILES_DIR, "onevent_forwarder.py"), "--hook-fifo", forwarder_path,
+                                          "--librespot-fifo", fifo_path, "--librespot-journal", os.path.join(tmp_dir, "journal")])
+            while not os.path.exists(forwarder_path):
+                time.sleep(0.01)
+
+        base_env = {
+            "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+            "ONEVENT_FIFO": fifo_path,
+            "ONEVENT_JOURNAL": os.path.join(tmp_dir, "journal"),
+            "ONEVENT_FORWARDER": forwarder_path
+        }
+
+        launcher = subprocess.Popen([python, "-S", "-c", LAUNCHER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+        try:
+            for variant in variants:
+                command = commands[variant]
+                for event in events:
+                    env = dict(base_env, **EVENTS[event])
+                    if variant == "fallback":
+                        env["ONEVENT_FORWARDER"] = os.path.join(tmp_dir, "none")
+                    # Warm up the page cache and the bytecode caches
+                    run(launcher, command, env)
+                    runs = [run(launcher, command, env) for _ in range(repeat)]
+                    result = {"variant": variant, "event": event}
+                    for key in ("wall", "user", "sys", "rss"):
+                        result[key] = statistics.median(r[key] for r in runs)
+                    result["import"] = import_time(command, env)
+                    results.append(result)
+        finally:
+            launcher.stdin.close()
+            launcher.wait()
+            if forwarder is not None:
+                forwarder.terminate()
+                forwarder.wait()
+            stop.set()
+            # Unblock the drainer
+            with open(fifo_path, "w"):
+                pass
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), description="Measure the cold start cost of the librespot hook for every event and variant.")
+
+    parser.add_argument('-p', '--python', default=sys.executable, help='Set the interpreter to run the hook with (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='Set the number of runs per variant and event (default: %(default)s)')
+    parser.add_argument('--variants', default=",".join(VARIANTS), help='Set the comma-separated variants to benchmark (default: %(default)s)')
+    parser.add_argument('--events', default=",".join(EVENTS), help='Set the comma-separated events to benchmark (default: all)')
+    parser.add_argument('--json', metavar='FILE', help='Also write the results to a JSON file, for comparison between versions')
+
+    args = parser.parse_args()
+
+    results = benchmark(args.python, args.variants.split(","), args.events.split(","), args.repeat)
+
+    print(f"{'variant':<8} {'event':<20} {'wall ms':>8} {'user ms':>8} {'sys ms':>8} {'rss KiB':>8} {'import ms':>9}")
+    for r in results:
+        imports = f"{r['import']:9.2f}" if r['import'] is not None else f"{'-':>9}"
+        print(f"{r['variant']:<8} {r['event']:<20} {r['wall']:8.2f} {r['user']:8.2f} {r['sys']:8.2f} {int(r['rss']):8d} {imports}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+PLUGIN = os.path.join(FILES_DIR, "meta_librespot.py")
+
+def cpu_time(pid):
+    """
+    Returns the CPU time consumed by a process so far.
+
+    Args:
+        pid (int): The process identifier.
+
+    Returns:
+        float: The user plus system CPU time of the process, in seconds.
+    """
+    with open(f"/proc/{pid}/stat") as stat:
+        # The command name may contain spaces, the numeric fields start after its closing parenthesis
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def write_event(fifo_path, event):
+    """
+    Writes one event to the named pipe the way onevent_fifo.py does: open, write one line, close.
+
+    Args:
+        fifo_path (str): The file system path to the named pipe.
+        event (dict): The event data to be sent.
+    """
+    with open(fifo_path, "w") as fifo:
+        fifo.write(json.dumps(event) + "\n")
+
+def measure(duration, events):
+    """
+    Starts meta_librespot.py against a private named pipe and measures its CPU usage while idle.
+
+    Args:
+        duration (float): The idle measurement window, in seconds.
+        events (int): The number of hook-like writers to open and close the pipe before measuring.
+
+    Returns:
+        float: The CPU usage of the plugin during the window, in percent of one core.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fifo_path = os.path.join(tmp_dir, "spotfifo")
+        plugin = subprocess.Popen(
+            [sys.executable, PLUGIN, "--config", os.path.join(tmp_dir, "none.conf"), "--librespot-fifo", fifo_path,
+             "--librespot-journal", os.path.join(tmp_dir, "journal")],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            ready = json.loads(plugin.stdout.readline())
+            if ready.get("method") != "Plugin.Stream.Ready":
+                raise RuntimeError(f"Unexpected message from plugin: {ready}")
+
+            for i in range(events):
+                write_event(fifo_path, {"event": "volume_changed", "volume": 65535 * i // max(events, 1)})
+                plugin.stdout.readline()
+
+            start_cpu, start_wall = cpu_time(plugin.pid), time.monotonic()
+            time.sleep(duration)
+            end_cpu, end_wall = cpu_time(plugin.pid), time.monotonic()
+        finally:
+            plugin.terminate()
+            plugin.wait()
+
+    return (end_cpu - start_cpu) / (end_wall - start_wall) * 100.0
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), description="Measure the idle CPU usage of meta_librespot.py after librespot hooks closed the FIFO.")
+
+    parser.add_argument('-d', '--duration', type=float, default=5.0, help='Set the idle measurement window in seconds (default: %(default)s)')
+    parser.add_argument('-e', '--events', type=int, default=3, help='Set the number of events written before measuring (default: %(default)s)')
+    parser.add_argument('-t', '--threshold', type=float, default=2.0, help='Fail when idle CPU usage exceeds this percentage (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    usage = measure(args.duration, args.events)
+    print(f"idle cpu: {usage:.2f}% over {args.duration:.1f}s after {args.events} events (threshold {args.threshold:.2f}%)")
+    sys.exit(0 if usage <= args.threshold else 1)
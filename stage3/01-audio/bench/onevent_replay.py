@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import collections
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+sys.path.insert(0, FILES_DIR)
+
+import onevent_fifo
+
+TRACK_IDS = ("4uLU6hMCjMI75M1A2tKUQC", "7GhIk7Il098yCjg4BQjzvb", "0VjIjW4GlUZAMYd2vXMi3b", "3n3Ppam7vgaVa1iaRUc9Lp")
+
+def load(path):
+    """
+    Loads a trace recorded with ONEVENT_CAPTURE or generated by this tool.
+
+    Args:
+        path (str): The file system path to the JSONL trace.
+
+    Returns:
+        list: The records of the trace, each one with the "ts" and "env" of a hook run.
+    """
+    with open(path) as trace:
+        return [json.loads(line) for line in trace if line.strip()]
+
+def track_changed(track_id, ts):
+    """
+    Returns a trace record for a track change.
+    """
+    return {"ts": ts, "env": {
+        "PLAYER_EVENT": "track_changed", "ITEM_TYPE": "Track", "TRACK_ID": track_id, "URI": f"spotify:track:{track_id}",
+        "NAME": f"Track {track_id}", "DURATION_MS": "213573", "IS_EXPLICIT": "false", "LANGUAGE": "en",
+        "COVERS": f"https://i.scdn.co/image/{track_id}", "NUMBER": "1", "DISC_NUMBER": "1", "POPULARITY": "50",
+        "ALBUM": "Album", "ARTISTS": "Artist", "ALBUM_ARTISTS": "Artist"
+    }}
+
+def position(event, track_id, position_ms, ts):
+    """
+    Returns a trace record for a playing, paused, seeked or position_correction event.
+    """
+    return {"ts": ts, "env": {"PLAYER_EVENT": event, "TRACK_ID": track_id, "POSITION_MS": str(position_ms)}}
+
+def generate(pattern, count, interval_ms):
+    """
+    Generates a pathological event sequence.
+
+    Args:
+        pattern (str): "skip" for rapid track skipping, "seek" for a seek storm, "volume" for a volume slider drag.
+        count (int): The number of skips, seeks or volume changes.
+        interval_ms (float): The time between two of them, in milliseconds.
+
+    Returns:
+        list: The records of the trace.
+    """
+    ts = 0
+    step = int(interval_ms * 1e6)
+    records = [track_changed(TRACK_IDS[0], ts), position("playing", TRACK_IDS[0], 0, ts)]
+    for i in range(count):
+        ts += step
+        match pattern:
+            case "skip":
+                track_id = TRACK_IDS[(i + 1) % len(TRACK_IDS)]
+                records.append({"ts": ts, "env": {"PLAYER_EVENT": "loading", "TRACK_ID": track_id, "POSITION_MS": "0"}})
+                records.append(track_changed(track_id, ts + 1))
+                records.append(position("playing", track_id, 0, ts + 2))
+            case "seek":
+                records.append(position("seeked", TRACK_IDS[0], random.randrange(213573), ts))
+                if i % 10 == 9:
+                    records.append(position("position_correction", TRACK_IDS[0], random.randrange(213573), ts + 1))
+            case "volume":
+                records.append({"ts": ts, "env": {"PLAYER_EVENT": "volume_changed", "VOLUME": str(i * 65535 // max(count - 1, 1))}})
+    return records
+
+def pace(records, speed):
+    """
+    Yields the records of a trace at their recorded pace, scaled by a speed factor.
+
+    Args:
+        records (list): The records of the trace.
+        speed (float): The speed factor, 1 for real time, 0 for maximum speed.
+
+    Yields:
+        dict: The next record, when it is due.
+    """
+    start = time.monotonic()
+    origin = (records[0]["ts"] or 0) if records else 0
+    for record in records:
+        if speed > 0 and record["ts"] is not None:
+            delay = (record["ts"] - origin) / 1e9 / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        yield record
+
+def replay_fifo(records, speed, fifo_path, journal_path=None):
+    """
+    Replays a trace into a named pipe, the way the forwarder sends hook events.
+
+    Args:
+        records (list): The records of the trace.
+        speed (float): The speed factor, 1 for real time, 0 for maximum speed.
+        fifo_path (str): The file system path to the named pipe read by meta_librespot.py.
+        journal_path (str): The file system path to the journal the events are appended to, or None for a temporary
+            one, so that the replayed events never end up in the journal of a live plugin.
+
+    Returns:
+        dict: The replay statistics.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onevent_fifo.FIFO_PATH = fifo_path
+        onevent_fifo.JOURNAL_PATH = journal_path or os.path.join(tmp_dir, "journal")
+        start = time.monotonic()
+        for record in pace(records, speed):
+            # Stamp the events with the replay time, so that the plugin orders them the same way
+            onevent_fifo.dispatch(dict(record["env"], ONEVENT_TS=str(time.clock_gettime_ns(time.CLOCK_MONOTONIC))))
+        return {"events": len(records), "elapsed": time.monotonic() - start}
+
+def replay_plugin(records, speed):
+    """
+    Replays a trace directly into LibrespotControl._on_fifo_data, without any FIFO nor Spotify account.
+
+    Args:
+        records (list): The records of the trace.
+        speed (float): The speed factor, 1 for real time, 0 for maximum speed.
+
+    Returns:
+        dict: The replay statistics, including the notifications the plugin sent to snapserver.
+    """
+    import meta_librespot
+
+    notifications = collections.Counter()
+    output = {"bytes": 0}
+
+    def send(msg):
+        notifications[msg.get("method", "response")] += 1
+        output["bytes"] += len(json.dumps(msg)) + 1
+
+    meta_librespot.send = send
+    control = meta_librespot.LibrespotControl()
+
+    lines = []
+    onevent_fifo.send = lambda event: lines.append(json.dumps(dict(event, ts=onevent_fifo.emit_time)))
+
+    start = time.monotonic()
+    for record in pace(records, speed):
+        del lines[:]
+        onevent_fifo.dispatch(dict(record["env"], ONEVENT_TS=str(time.clock_gettime_ns(time.CLOCK_MONOTONIC))))
+        for line in lines:
+            control._on_fifo_data(line)
+    elapsed = time.monotonic() - start
+
+    return {"events": len(records), "elapsed": elapsed, "notifications": dict(notifications), "bytes": output["bytes"],
+            "suppression": control._notification_stats(), "drift": control._clock.drift}
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), description="Generate and replay librespot event traces recorded with ONEVENT_CAPTURE.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='Generate a pathological trace')
+    generate_parser.add_argument('pattern', choices=('skip', 'seek', 'volume'), help='Set the event pattern')
+    generate_parser.add_argument('-n', '--count', type=int, default=100, help='Set the number of skips, seeks or volume changes (default: %(default)s)')
+    generate_parser.add_argument('-i', '--interval', type=float, default=50.0, help='Set the interval between them in milliseconds (default: %(default)s)')
+    generate_parser.add_argument('-o', '--output', required=True, help='Set the trace file to write')
+
+    replay_parser = subparsers.add_parser('replay', help='Replay a trace')
+    replay_parser.add_argument('trace', help='Set the trace file to replay')
+    replay_parser.add_argument('-t', '--target', choices=('fifo', 'plugin'), default='plugin', help='Replay into a running plugin through its FIFO, or into an in-process plugin (default: %(default)s)')
+    replay_parser.add_argument('-s', '--speed', type=float, default=1.0, help='Set the speed factor, 0 for maximum speed (default: %(default)s)')
+    replay_parser.add_argument('--librespot-fifo', default=onevent_fifo.FIFO_PATH, help='Set the fifo to replay into (default: %(default)s)')
+    replay_parser.add_argument('--librespot-journal', help='Set the journal the replayed events are appended to (default: a temporary journal)')
+    replay_parser.add_argument('--json', metavar='FILE', help='Also write the statistics to a JSON file, for comparison between versions')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        with open(args.output, "w") as trace:
+            for record in generate(args.pattern, args.count, args.interval):
+                trace.write(json.dumps(record) + "\n")
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    records = load(args.trace)
+    if args.target == 'fifo':
+        stats = replay_fifo(records, args.speed, args.librespot_fifo, args.librespot_journal)
+    else:
+        stats = replay_plugin(records, args.speed)
+
+    print(f"{stats['events']} events in {stats['elapsed']:.3f} s ({stats['events'] / max(stats['elapsed'], 1e-9):.0f} events/s)")
+    if "notifications" in stats:
+        for method, count in sorted(stats["notifications"].items()):
+            print(f"{method}: {count}")
+        print(f"stdout: {stats['bytes']} bytes")
+        print(f"suppressed: {stats['suppression']['suppressed']} ({stats['suppression']['suppression_rate']:.0%}), without metadata: {stats['suppression']['without_metadata']}")
+        drift = stats["drift"]
+        if drift["count"]:
+            print(f"position drift: average {drift['total'] / drift['count'] * 1000.0:.1f} ms, max {drift['max'] * 1000.0:.1f} ms over {drift['count']} corrections")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(stats, file, indent=2)
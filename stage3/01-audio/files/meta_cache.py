@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# A cache of the metadata looked up in the Spotify Web API, keyed by item, e.g. "track:4uLU6hMCjMI75M1A2tKUQC".
+#
+# The most recently used entries are kept in memory, and every entry is stored as a small JSON file
+# in a directory, so that the cache survives restarts. The keys on disk are listed once when the
+# cache is opened, so that a miss never touches the disk.
+
+import os
+import json
+import errno
+import tempfile
+import threading
+import collections
+
+MEMORY_SIZE = 256
+
+# The oldest files are removed beyond this number of entries on disk
+DISK_SIZE = 10000
+
+class MetadataCache(object):
+
+    def __init__(self, path, memory_size=MEMORY_SIZE, disk_size=DISK_SIZE):
+        """
+        Opens a metadata cache, creating its directory if needed.
+
+        Args:
+            path (str): The file system path to the cache directory, or None to keep the entries in memory only.
+            memory_size (int): The number of entries kept in memory.
+            disk_size (int): The number of entries kept on disk.
+
+        Raises:
+            OSError: If the cache directory cannot be created or written to.
+        """
+        self._path = path
+        self._memory_size = memory_size
+        self._disk_size = disk_size
+        self._memory = collections.OrderedDict()
+        # The keys of the entries on disk, oldest first, shared with save() in worker threads under the lock
+        self._disk = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        if path is None:
+            return
+        os.makedirs(path, exist_ok=True)
+        if not os.access(path, os.W_OK | os.X_OK):
+            raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), path)
+        files = sorted((entry for entry in os.scandir(path) if entry.name.endswith(".json")), key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:max(0, len(files) - disk_size)]:
+            os.unlink(entry.path)
+        self._disk = dict.fromkeys(entry.name[:-len(".json")].replace("-", ":", 1) for entry in files[-disk_size:])
+
+    def _file(self, key):
+        """
+        Returns the file system path to the file of an entry.
+        """
+        return os.path.join(self._path, key.replace(":", "-", 1) + ".json")
+
+    def get(self, key):
+        """
+        Looks an entry up, in memory first, then on disk.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            dict: The entry, or None if it is not cached.
+        """
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return value
+
+        with self._lock:
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                with open(self._file(key)) as file:
+                    value = json.load(file)
+            except (OSError, ValueError):
+                with self._lock:
+                    self._disk.pop(key, None)
+            else:
+                self.stats["disk_hits"] += 1
+                self.put(key, value)
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    def __contains__(self, key):
+        if key in self._memory:
+            return True
+        with self._lock:
+            return key in self._disk
+
+    def put(self, key, value):
+        """
+        Stores an entry in memory, evicting the least recently used one if the cache is full.
+
+        Args:
+            key (str): The key of the entry.
+            value (dict): The entry.
+        """
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def save(self, key, value):
+        """
+        Stores an entry on disk, removing the oldest one if there are more than disk_size entries.
+
+        The file is replaced atomically, so that a concurrent reader never sees a partial entry.
+        Safe to call from a worker thread. Does nothing if the cache is kept in memory only.
+
+        Args:
+            key (str): The key of the entry.
+            value (dict): The entry.
+        """
+        if self._path is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self._path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(value, file)
+            os.replace(tmp_path, self._file(key))
+        except:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self._disk.pop(key, None)
+            self._disk[key] = None
+            while len(self._disk) > self._disk_size:
+                oldest = next(iter(self._disk))
+                del self._disk[oldest]
+                try:
+                    os.unlink(self._file(oldest))
+                except FileNotFoundError:
+                    pass
@@ -2,32 +2,75 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import sys
 import json
+import time
 import select
+import signal
 import getopt
+import asyncio
+import functools
 import logging
 import argparse
+import collections
 from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 
 from spotipy import CacheFileHandler, Spotify
 from spotipy.oauth2 import SpotifyOAuth
 
+from onevent_bus import Listener, Subscriber, SOCKET_TYPES, parse_endpoint
+from onevent_fifo import instance_path, FRAGMENT_PREFIX
+from onevent_journal import Journal, JOURNAL_PATH
+from meta_metrics import Registry, serve as serve_metrics
+from meta_cache import MetadataCache
+
 VERSION = "1.0"
 
 SCOPES = "user-read-playback-state,user-modify-playback-state,user-read-currently-playing"
 
 FIFO_PATH = "/tmp/spotfifo"
+BUS_SUBSCRIBER = "snapcast"
+READ_SIZE = 65536
+# Volume and seek requests arriving within this window after a Spotify call are merged into the next one, in seconds
+COALESCE_WINDOW = 0.1
+# How long an optimistic update waits for librespot to confirm it before resynchronizing with Spotify, in seconds
+CONFIRM_TIMEOUT = 5.0
+# The loop status matching each Spotify Web API repeat state
+LOOP_STATUS = {"off": "none", "track": "track", "context": "playlist"}
+# Notifications that may be dropped rather than queued without bound when snapserver does not read standard output
+MAX_QUEUED_LOGS = 256
+# How long to keep writing the queued messages to snapserver when exiting, in seconds
+FLUSH_TIMEOUT = 1.0
+# Spotify IDs in Web API paths, replaced so that calls are counted by endpoint rather than by item
+SPOTIFY_ID = re.compile(r"/[0-9A-Za-z]{22}(?=/|$)")
 CREDENTIALS_FILE = os.path.normpath(os.path.join(os.path.dirname(__file__), "credentials.json"))
+# Writable by snapserver, unlike the plug-ins directory
+METADATA_CACHE = "/var/cache/snapserver/meta_librespot"
 CONFIGURATION_FILE =  os.path.normpath(os.path.join(os.path.dirname(__file__), "meta_librespot.conf"))
 
+logger = logging.getLogger('meta_librespot')
+
+# The output stage of standard output, once the event loop runs
+output = None
+
 params = {
     'config': CONFIGURATION_FILE,
-    'librespot_fifo': FIFO_PATH,
+    'instance': 'default',
+    'librespot_fifo': None,
+    'librespot_journal': None,
     'spotify_client_id': None,
     'spotify_client_secret': None,
     'spotify_redirect_uri': None,
     'spotify_credentials_file': CREDENTIALS_FILE,
+    'spotify_device_id': None,
+    'spotify_workers': 2,
+    'metrics': None,
+    'trace_size': 4096,
+    'enrich_metadata': False,
+    'metadata_cache': METADATA_CACHE,
     'snapcast_host': 'localhost',
     'snapcast_port': 1780,
     'stream': 'default'
@@ -41,8 +84,13 @@ def send(msg):
         msg (Any): The message object to be serialized to JSON and sent.
 
     Notes:
-        The function writes the serialized message followed by a newline to stdout and flushes the output buffer.
+        Once the event loop runs, the message is queued on the output stage and written with the other
+        messages of the same loop iteration. Until then, the function writes the serialized message
+        followed by a newline to stdout and flushes the output buffer.
     """
+    if output is not None:
+        output.send(msg)
+        return
     sys.stdout.write(json.dumps(msg) + "\n")
     sys.stdout.flush()
 
@@ -62,18 +110,451 @@ def log(txt):
             }
         send(msg)
 
-def opener(path, flags):
+def read_chunk(fd):
+    """
+    Reads one chunk from a non-blocking file descriptor.
+
+    Args:
+        fd (int): The file descriptor.
+
+    Returns:
+        bytes: The data read, empty at end-of-file, or None if no data is available.
+    """
+    try:
+        return os.read(fd, READ_SIZE)
+    except BlockingIOError:
+        return None
+
+def read_available(fd):
     """
-    Opens a file at the specified path with the given flags, ensuring the file is opened in non-blocking mode.
+    Reads everything currently available from a non-blocking file descriptor.
 
     Args:
-        path (str): The file system path to the file to be opened.
-        flags (int): Flags that determine how the file is to be opened (e.g., os.O_RDONLY).
+        fd (int): The file descriptor.
 
     Returns:
-        int: A file descriptor for the opened file.
+        tuple: The data read, as bytes, and True if end-of-file was reached.
     """
-    return os.open(path, flags | os.O_NONBLOCK)
+    chunks = []
+    while True:
+        try:
+            chunk = os.read(fd, READ_SIZE)
+        except BlockingIOError:
+            return b"".join(chunks), False
+        if not chunk:
+            return b"".join(chunks), True
+        chunks.append(chunk)
+
+def open_keepalive(path):
+    """
+    Opens the write end of a named pipe so that its reader never sees end-of-file.
+
+    Each librespot hook opens the pipe, writes one event and closes it. Once the last writer is gone,
+    the read end stays readable at end-of-file and select() returns immediately forever. Holding a
+    writer open ourselves keeps the pipe "connected", so select() sleeps until a real event arrives.
+
+    Args:
+        path (str): The file system path to the named pipe. Its read end must already be open.
+
+    Returns:
+        int: A file descriptor for the write end, or None if the pipe cannot be opened for writing.
+    """
+    try:
+        return os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+    except OSError as e:
+        logger.warning(f"Failed to open FIFO {path} for writing, reopening it on end-of-file instead: {e}")
+        return None
+
+class Writer(object):
+
+    def __init__(self, fd, loop):
+        """
+        Initializes the output stage of the JSON-RPC messages sent to snapserver.
+
+        Messages are queued and written once per loop iteration, with a single write for all of them.
+        The file descriptor is non-blocking: if snapserver does not read, the rest is written when the
+        pipe becomes writable again, and the plugin keeps running meanwhile. Responses and other
+        messages are never dropped. A Plugin.Stream.Player.Properties notification not written yet is
+        replaced by the next one, and only the newest MAX_QUEUED_LOGS Plugin.Stream.Log messages are kept.
+
+        Args:
+            fd (int): The file descriptor of standard output.
+            loop (asyncio.AbstractEventLoop): The event loop.
+        """
+        self._fd = fd
+        self._loop = loop
+        self._queue = collections.deque()
+        self._buffer = bytearray()
+        self._scheduled = False
+        self._waiting = False
+        self._logs = 0
+        self.stats = {"messages": 0, "writes": 0, "replaced": 0, "dropped": 0, "blocked": 0}
+        os.set_blocking(fd, False)
+
+    def send(self, msg):
+        """
+        Queues a message.
+
+        Args:
+            msg (dict): The JSON-RPC message.
+        """
+        self.stats["messages"] += 1
+        match msg.get("method"):
+            case "Plugin.Stream.Player.Properties":
+                for index, queued in enumerate(self._queue):
+                    if queued.get("method") == "Plugin.Stream.Player.Properties":
+                        del self._queue[index]
+                        # Snapserver keeps the metadata when they are omitted, the replaced ones must not be lost
+                        if "metadata" not in msg["params"] and "metadata" in queued["params"]:
+                            msg = dict(msg, params=dict(msg["params"], metadata=queued["params"]["metadata"]))
+                        self.stats["replaced"] += 1
+                        break
+            case "Plugin.Stream.Log":
+                if self._logs >= MAX_QUEUED_LOGS:
+                    for index, queued in enumerate(self._queue):
+                        if queued.get("method") == "Plugin.Stream.Log":
+                            del self._queue[index]
+                            self._logs -= 1
+                            self.stats["dropped"] += 1
+                            break
+                self._logs += 1
+        self._queue.append(msg)
+        if not self._scheduled and not self._waiting:
+            self._scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def depth(self):
+        """
+        Returns the number of messages queued and the number of bytes serialized but not written yet.
+        """
+        return len(self._queue), len(self._buffer)
+
+    def _serialize(self):
+        """
+        Moves the queued messages to the write buffer.
+        """
+        while self._queue:
+            self._buffer += (json.dumps(self._queue.popleft()) + "\n").encode()
+        self._logs = 0
+
+    def _flush(self):
+        """
+        Writes as much of the queued messages as the pipe accepts, then waits for it to be writable if some are left.
+        """
+        self._scheduled = False
+        # Messages are only serialized when the pipe has room, so that the queued ones can still be replaced
+        if not self._buffer:
+            self._serialize()
+        try:
+            while self._buffer:
+                written = os.write(self._fd, self._buffer)
+                self.stats["writes"] += 1
+                del self._buffer[:written]
+                if not self._buffer:
+                    self._serialize()
+        except BlockingIOError:
+            if not self._waiting:
+                self.stats["blocked"] += 1
+                self._waiting = True
+                self._loop.add_writer(self._fd, self._flush)
+            return
+        if self._waiting:
+            self._waiting = False
+            self._loop.remove_writer(self._fd)
+
+    def close(self, timeout=FLUSH_TIMEOUT):
+        """
+        Writes the messages left, giving up if snapserver does not read them within a timeout.
+
+        Args:
+            timeout (float): How long to wait for the pipe to be writable, in seconds.
+        """
+        if self._waiting:
+            self._loop.remove_writer(self._fd)
+            self._waiting = False
+        self._serialize()
+        deadline = time.monotonic() + timeout
+        while self._buffer:
+            try:
+                del self._buffer[:os.write(self._fd, self._buffer)]
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([], [self._fd], [], remaining)[1]:
+                    logger.warning(f"Dropping {len(self._buffer)} bytes snapserver did not read")
+                    break
+            except OSError:
+                break
+        os.set_blocking(self._fd, True)
+
+class TraceRing(object):
+
+    def __init__(self, size):
+        """
+        Initializes a fixed-size ring of trace records.
+
+        Recording stores a tuple of references in a preallocated slot, overwriting the oldest record.
+        Nothing is formatted until the ring is dumped, so tracing can stay enabled in production.
+
+        Args:
+            size (int): The number of records kept, 0 to disable tracing.
+        """
+        self._records = [None] * size
+        self._size = size
+        self._next = 0
+
+    def record(self, kind, *fields):
+        """
+        Records an entry.
+
+        The fields are kept by reference, they must not be modified afterwards.
+
+        Args:
+            kind (str): The kind of the entry, e.g. "event", "request" or "properties".
+            *fields: The fields of the entry.
+        """
+        if self._size:
+            self._records[self._next % self._size] = (time.time(), kind, fields)
+            self._next += 1
+
+    def dump(self):
+        """
+        Formats the records, oldest first.
+
+        Returns:
+            list: One line per record.
+        """
+        lines = []
+        for index in range(max(0, self._next - self._size), self._next):
+            t, kind, fields = self._records[index % self._size]
+            lines.append(f"{time.strftime('%H:%M:%S', time.localtime(t))}.{int(t * 1000) % 1000:03d} {kind} {' '.join(str(field) for field in fields)}")
+        return lines
+
+class LineFramer(object):
+
+    def __init__(self, max_line=1 << 20):
+        """
+        Initializes a framer that splits a byte stream into newline-terminated messages.
+
+        Bytes are accumulated in a buffer that is reused across reads, so a message split over
+        several reads is only decoded once complete.
+
+        Args:
+            max_line (int): The maximum size of an incomplete message, it is discarded beyond it.
+        """
+        self._max_line = max_line
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Appends data read from the stream and returns the messages it completes.
+
+        Args:
+            data (bytes): The data read from the stream.
+
+        Returns:
+            list: The complete messages, as str, stripped of leading/trailing whitespace, empty ones excluded.
+                Fragment lines are only stripped of their newline, as their data may end or start with whitespace.
+        """
+        self._buffer += data
+        end = self._buffer.rfind(b"\n")
+        if end < 0:
+            if len(self._buffer) > self._max_line:
+                logger.warning(f"Discarding {len(self._buffer)} bytes without a newline")
+                self._buffer.clear()
+            return []
+        lines = self._buffer[:end].decode(errors="replace").split("\n")
+        del self._buffer[:end + 1]
+        return [line if line.startswith(FRAGMENT_PREFIX) else line.strip() for line in lines if line.strip()]
+
+class Reassembler(object):
+
+    def __init__(self, max_pending=16):
+        """
+        Initializes a reassembler for the events the librespot hooks split into fragments.
+
+        Each fragment line has the form "~<id> <index> <count> <data>". Fragments of different events
+        may interleave, so they are collected per event id until all of them were received.
+
+        Args:
+            max_pending (int): The maximum number of incomplete events kept, the oldest one is discarded beyond it.
+        """
+        self._max_pending = max_pending
+        self._pending = {}
+
+    def feed(self, line):
+        """
+        Collects a fragment line.
+
+        Args:
+            line (str): The fragment line, without its trailing newline.
+
+        Returns:
+            str: The reassembled event once its last fragment was received, None otherwise.
+        """
+        id, index, count, data = line[len(FRAGMENT_PREFIX):].split(" ", 3)
+        fragments = self._pending.setdefault(id, [None] * int(count))
+        fragments[int(index)] = data
+
+        if None not in fragments:
+            del self._pending[id]
+            return "".join(fragments)
+
+        if len(self._pending) > self._max_pending:
+            # The hook that wrote this event died or gave up before writing all of its fragments
+            logger.warning(f"Discarding incomplete librespot event {next(iter(self._pending))}")
+            del self._pending[next(iter(self._pending))]
+        return None
+
+class Coalescer(object):
+
+    def __init__(self, name, apply, spawn, merge=None):
+        """
+        Initializes a latest-wins stage in front of a Spotify Web API call.
+
+        When no call is in flight, a value is sent right away. Otherwise values are merged into a
+        single pending one, which is sent once the call in flight completed and COALESCE_WINDOW
+        elapsed, so that there is at most one call in flight at a time and never a queue of stale ones.
+
+        Args:
+            name (str): The name of the stage, used in log messages.
+            apply (callable): Returns the coroutine sending a value to Spotify.
+            spawn (callable): Runs the coroutine, in the order of the control commands.
+            merge (callable): Merges the pending value with a newer one, by default the newer one wins.
+        """
+        self._name = name
+        self._apply = apply
+        self._spawn = spawn
+        self._merge = merge or (lambda pending, value: value)
+        self._pending = None
+        self._timer = None
+        self._in_flight = False
+        self.collapsed = 0
+
+    @property
+    def pending(self):
+        """
+        The value waiting to be sent, None if there is none.
+        """
+        return self._pending
+
+    def submit(self, value):
+        """
+        Queues a value, merging it with the pending one, if any.
+
+        Args:
+            value (Any): The value.
+        """
+        if self._pending is not None:
+            self.collapsed += 1
+            value = self._merge(self._pending, value)
+        self._pending = value
+        if self._timer is None and not self._in_flight:
+            self._flush()
+
+    def _flush(self):
+        """
+        Sends the pending value, unless a call is still in flight.
+        """
+        self._timer = None
+        if self._pending is None or self._in_flight:
+            return
+        value, self._pending = self._pending, None
+        self._in_flight = True
+        logger.debug("Sending %s %s (%d requests collapsed so far)", self._name, value, self.collapsed)
+        self._spawn(None, self._send(value))
+
+    async def _send(self, value):
+        """
+        Sends a value, then schedules the value that arrived in the meantime, if any.
+        """
+        try:
+            await self._apply(value)
+        finally:
+            self._in_flight = False
+            if self._pending is not None:
+                self._timer = asyncio.get_running_loop().call_later(COALESCE_WINDOW, self._flush)
+
+    def cancel(self):
+        """
+        Forgets the pending value.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = None
+
+class PositionClock(object):
+
+    def __init__(self):
+        """
+        Initializes a playback position clock, anchored on the last position librespot reported.
+
+        The position is extrapolated from the anchor (position, CLOCK_MONOTONIC time, rate, state),
+        so that the current position is known at any time without asking the Spotify Web API.
+        """
+        self.position = 0.0
+        self.anchor = time.monotonic()
+        self.rate = 1.0
+        self.playing = False
+        self.drift = {"count": 0, "total": 0.0, "max": 0.0}
+
+    def now(self, at=None):
+        """
+        Returns the extrapolated playback position.
+
+        Args:
+            at (float): The time.monotonic() value to extrapolate to, the current time by default.
+
+        Returns:
+            float: The playback position in seconds.
+        """
+        if not self.playing:
+            return self.position
+        return self.position + max(0.0, (at if at is not None else time.monotonic()) - self.anchor) * self.rate
+
+    def update(self, position=None, playing=None, at=None):
+        """
+        Moves the anchor of the clock.
+
+        Args:
+            position (float): The playback position in seconds, None to keep extrapolating from the previous anchor.
+            playing (bool): Whether the position advances, None if the playback state did not change.
+            at (float): The time.monotonic() value at which the position was reported, the current time by default.
+        """
+        at = at if at is not None else time.monotonic()
+        self.position = position if position is not None else self.now(at)
+        self.anchor = at
+        if playing is not None:
+            self.playing = playing
+
+    def timeline(self):
+        """
+        Returns what the extrapolated position depends on, so that two anchors on the same timeline compare equal.
+
+        Returns:
+            tuple: (False, position) when paused, (True, rate, offset) when playing, where the position at
+                time t is rate * t + offset, to the millisecond.
+        """
+        if self.playing:
+            return (True, self.rate, round(self.position - self.anchor * self.rate, 3))
+        return (False, round(self.position, 3))
+
+    def correct(self, position, at=None):
+        """
+        Records how far the extrapolated position drifted from a position librespot reported.
+
+        Args:
+            position (float): The reported playback position in seconds.
+            at (float): The time.monotonic() value at which the position was reported, the current time by default.
+
+        Returns:
+            float: The drift in seconds, positive if the clock was ahead.
+        """
+        drift = self.now(at) - position
+        self.drift["count"] += 1
+        self.drift["total"] += abs(drift)
+        self.drift["max"] = max(self.drift["max"], abs(drift))
+        return drift
 
 class LibrespotControl(object):
 
@@ -89,6 +570,44 @@ class LibrespotControl(object):
         """
         self._properties = {}
         self._sp = None
+        self._journal = None
+        self._replayed_seq = 0
+        self._reassembler = Reassembler()
+        self._emitted = {}
+        self._stale_events = 0
+        self._latency = {"count": 0, "total": 0.0, "max": 0.0}
+        self._session = {}
+        self._loop = None
+        self._executor = None
+        # Control commands reach Spotify one at a time, in the order they were issued
+        self._commands = asyncio.Lock()
+        self._tasks = set()
+        self._volume = Coalescer("volume", self._set_volume, self._spawn)
+        # Seeks are merged as (base position, offset): relative offsets add up, an absolute position replaces them
+        self._seek_target = Coalescer("position", lambda target: self._set_position(target[0] + target[1]), self._spawn,
+                                      lambda pending, target: target if target[0] is not None else (pending[0], pending[1] + target[1]))
+        # The serialized properties (without metadata) and metadata last published, to send only what changed
+        self._published = (None, None)
+        # The emission times of the events applied since the last notification, in nanoseconds
+        self._unpublished = []
+        self._api_in_flight = 0
+        self._metrics = Registry()
+        self._trace = TraceRing(params['trace_size'])
+        self._cache = None
+        # The metadata lookups in progress, by cache key
+        self._lookups = {}
+        # The ID of the item librespot preloads, until it becomes current or another one is preloaded
+        self._prefetched = None
+        self._prefetches = {"hit": 0, "late": 0, "miss": 0, "unused": 0}
+        # While the journal is replayed, the enrichment of the current item and the prefetch of the preloaded one, deferred until the replay ends
+        self._replay = None
+        self._describe_metrics()
+        self._clock = PositionClock()
+        # The optimistic updates waiting for librespot: property name -> (expected value, confirmed value, timer)
+        self._expected = {}
+        self._notifications = {"sent": 0, "suppressed": 0, "without_metadata": 0}
+        self._fifo = None
+        self._keepalive = None
 
         try:
             cache_handler = CacheFileHandler(cache_path=params["spotify_credentials_file"])
@@ -102,11 +621,19 @@ class LibrespotControl(object):
                     open_browser=False)
 
             self._sp = Spotify(auth_manager=auth_manager)
+            self._sp._session.hooks["response"].append(self._on_api_response)
         except:
             self._sp = None
 
         canControl = self._sp is not None
 
+        if params['enrich_metadata'] and self._sp is not None:
+            try:
+                self._cache = MetadataCache(params['metadata_cache'])
+            except OSError as e:
+                logger.warning(f"Failed to open metadata cache {params['metadata_cache']}, caching in memory only: {e}")
+                self._cache = MetadataCache(None)
+
         self._properties["canGoNext"] = canControl
         self._properties["canGoPrevious"] = canControl
         self._properties["canPlay"] = canControl
@@ -145,24 +672,76 @@ class LibrespotControl(object):
         """
         self._properties["volume"] = int(volume)
 
-    def _update_position(self, position):
+    def _update_position(self, position, ts=None):
         """
         Updates the current position in the track.
 
         Args:
             position (int): The current position in the track, in milliseconds.
+            ts (int): The CLOCK_MONOTONIC time at which librespot reported the position, in nanoseconds, or None if unknown.
         """
-        self._properties["position"] = position / 1000.0 # Convert milliseconds to seconds
+        self._clock.update(position / 1000.0, at=ts / 1e9 if ts is not None else None) # Convert milliseconds to seconds
+        self._properties["position"] = self._clock.position
 
-    def _update_state(self, state):
+    def _update_state(self, state, ts=None):
         """
         Updates the playback state of the player.
 
         Args:
             state (str): The playback state, such as "playing", "paused", or "stopped".
+            ts (int): The CLOCK_MONOTONIC time at which librespot reported the state, in nanoseconds, or None if unknown.
         """
+        self._clock.update(playing=state == "playing", at=ts / 1e9 if ts is not None else None)
+        self._properties["position"] = self._clock.position
         self._properties["playbackStatus"] = state
 
+    def _current_properties(self):
+        """
+        Returns the playback properties, with the position extrapolated to the current time.
+
+        Returns:
+            dict: A copy of the properties.
+        """
+        position = self._clock.now()
+        duration = self._properties.get("metadata", {}).get("duration")
+        if duration:
+            position = min(position, duration)
+        return dict(self._properties, position=round(position, 3))
+
+    def _update_shuffle(self, shuffle):
+        """
+        Updates the shuffle status of the player.
+
+        Args:
+            shuffle (bool): True if shuffle is enabled, False otherwise.
+        """
+        self._properties["shuffle"] = bool(shuffle)
+
+    def _update_loop_status(self, repeat, repeat_track):
+        """
+        Updates the loop status of the player from the librespot repeat settings.
+
+        Args:
+            repeat (bool): True if the context (playlist, album...) is repeated.
+            repeat_track (bool): True if the current track is repeated.
+        """
+        if repeat_track:
+            self._properties["loopStatus"] = "track"
+        elif repeat:
+            self._properties["loopStatus"] = "playlist"
+        else:
+            self._properties["loopStatus"] = "none"
+
+    def _update_session(self, **session):
+        """
+        Updates the librespot session state that has no Snapcast property counterpart.
+
+        Args:
+            **session: The session fields to update, e.g. user_name, client_name, auto_play or sink_status.
+        """
+        self._session.update(session)
+        logger.debug("Session: %s", self._session)
+
     def _update_track(self, track_id, title, duration_ms, album, artists, album_artists, uri, covers):
         """
         Updates the metadata for the current track.
@@ -185,8 +764,12 @@ class LibrespotControl(object):
             "artist": artists,
             "albumArtist": album_artists,
             "url": uri,
-            "artUrl": covers[-1]
         }
+        # The hook splits an empty COVERS variable into [""]
+        covers = [cover for cover in covers if cover]
+        if covers:
+            self._properties["metadata"]["artUrl"] = covers[0]
+        self._enrich("track", track_id)
 
     def _update_episode(self, track_id, title, duration_ms, uri):
         """
@@ -204,53 +787,274 @@ class LibrespotControl(object):
             "duration": duration_ms / 1000.0,  # Convert milliseconds to seconds
             "url": uri
         }
+        self._enrich("episode", track_id)
+
+    def _enrich(self, kind, item_id):
+        """
+        Completes the metadata of the current track or episode from the metadata cache, or looks them up in the background.
+
+        The base metadata are published right away in any case, the looked up ones are published
+        once they arrive if the item is still the current one.
+
+        Args:
+            kind (str): "track" or "episode".
+            item_id (str): The Spotify ID of the item.
+        """
+        if self._cache is None:
+            return
+        if self._replay is not None:
+            # Only the item that is current once the journal is replayed is enriched, a preload before it was consumed
+            self._replay["enrich"] = (kind, item_id)
+            self._replay.pop("prefetch", None)
+            return
+        key = f"{kind}:{item_id}"
+        if self._prefetched is not None:
+            if self._prefetched != item_id:
+                self._prefetches["unused"] += 1
+            elif key in self._cache:
+                self._prefetches["hit"] += 1
+            else:
+                self._prefetches["late" if key in self._lookups else "miss"] += 1
+            self._prefetched = None
+        fields = self._cache.get(key)
+        if fields is not None:
+            self._merge_metadata(item_id, fields)
+        elif self._loop is not None and key not in self._lookups:
+            self._lookups[key] = self._loop.create_task(self._lookup(kind, item_id))
+            self._lookups[key].add_done_callback(lambda _: self._lookups.pop(key, None))
+
+    def _prefetch(self, item_id):
+        """
+        Warms the metadata cache with the item librespot preloads, so that its metadata are complete as soon as it becomes current.
+
+        librespot does not tell whether the preloaded item is a track or an episode, it is looked up as a track.
+        A missing entry is looked up in the background. The check does not count as a cache lookup.
+
+        Args:
+            item_id (str): The Spotify ID of the preloaded item.
+        """
+        if self._cache is None or item_id == self._prefetched:
+            return
+        if self._replay is not None:
+            self._replay["prefetch"] = item_id
+            return
+        if self._prefetched is not None:
+            self._prefetches["unused"] += 1
+        self._prefetched = item_id
+        for kind in ("track", "episode"):
+            key = f"{kind}:{item_id}"
+            if key in self._lookups or key in self._cache:
+                return
+        if self._loop is not None:
+            key = f"track:{item_id}"
+            self._lookups[key] = self._loop.create_task(self._lookup("track", item_id))
+            self._lookups[key].add_done_callback(lambda _: self._lookups.pop(key, None))
+
+    def _merge_metadata(self, item_id, fields):
+        """
+        Adds looked up fields to the metadata of the current item, those reported by librespot take precedence.
+
+        Args:
+            item_id (str): The Spotify ID of the item the fields describe.
+            fields (dict): The looked up fields.
+
+        Returns:
+            bool: True if the item is the current one and its metadata were completed, False otherwise.
+        """
+        metadata = self._properties["metadata"]
+        if metadata.get("trackId") != item_id:
+            return False
+        if abs(fields.get("duration", metadata["duration"]) - metadata["duration"]) > 1.0:
+            self._trace.record("duration_mismatch", item_id, metadata["duration"], fields["duration"])
+        # A new dictionary, the published metadata are referenced by the trace
+        self._properties["metadata"] = dict({key: value for key, value in fields.items() if key != "duration"}, **metadata)
+        return True
+
+    async def _lookup(self, kind, item_id):
+        """
+        Looks the metadata of a track or episode up with the Spotify Web API, caches them and publishes them.
+
+        Args:
+            kind (str): "track" or "episode".
+            item_id (str): The Spotify ID of the item.
+        """
+        try:
+            if kind == "track":
+                track = await self._api(functools.partial(self._sp.track, item_id), "track")
+                artist_ids = [artist["id"] for artist in track["artists"] if artist.get("id")]
+                genres = set()
+                if artist_ids:
+                    artists = await self._api(functools.partial(self._sp.artists, artist_ids), "artists")
+                    genres = {genre for artist in artists["artists"] if artist for genre in artist.get("genres", ())}
+                images = track["album"].get("images") or []
+                fields = {
+                    "duration": track["duration_ms"] / 1000.0,
+                    "date": track["album"].get("release_date"),
+                    "trackNumber": track.get("track_number"),
+                    "discNumber": track.get("disc_number"),
+                    "genre": sorted(genres),
+                    "artUrl": images[0]["url"] if images else None
+                }
+            else:
+                episode = await self._api(functools.partial(self._sp.episode, item_id), "episode")
+                show = episode.get("show") or {}
+                images = episode.get("images") or show.get("images") or []
+                fields = {
+                    "duration": episode["duration_ms"] / 1000.0,
+                    "date": episode.get("release_date"),
+                    "album": show.get("name"),
+                    "artist": [show["publisher"]] if show.get("publisher") else None,
+                    "artUrl": images[0]["url"] if images else None
+                }
+        except Exception as e:
+            logger.warning(f"Failed to look up {kind} {item_id}: {e}")
+            return
+
+        key = f"{kind}:{item_id}"
+        fields = {name: value for name, value in fields.items() if value}
+        self._cache.put(key, fields)
+        if self._merge_metadata(item_id, fields):
+            self._send_properties()
+        try:
+            await self._loop.run_in_executor(self._executor, self._cache.save, key, fields)
+        except OSError as e:
+            logger.warning(f"Failed to cache {key}: {e}")
+
+    async def _call(self, method, *args):
+        """
+        Calls a Spotify Web API method in the worker pool, so that the event loop keeps running during the HTTP round trip.
+
+        The call targets the configured device, or the active one if none is configured.
+
+        Args:
+            method (callable): The Spotify client method, which must accept a device_id keyword argument.
+            *args: The arguments of the method.
+
+        Returns:
+            Any: The result of the method.
+        """
+        return await self._api(functools.partial(method, *args, device_id=params['spotify_device_id']), method.__name__)
+
+    async def _api(self, call, name):
+        """
+        Runs a Spotify Web API call in the worker pool, and records its latency and failures.
+
+        Args:
+            call (callable): The call, without arguments.
+            name (str): The name of the Spotify client method, used as metric label.
 
-    def _set_loop_status(self, loop_status):
+        Returns:
+            Any: The result of the call.
+        """
+        self._api_in_flight += 1
+        self._trace.record("api", name)
+        try:
+            with self._metrics.time("spotify_api_call_seconds", name):
+                return await self._loop.run_in_executor(self._executor, call)
+        except Exception as e:
+            self._metrics.inc("spotify_api_errors_total", name, getattr(e, "http_status", None) or "none")
+            raise
+        finally:
+            self._api_in_flight -= 1
+
+    def _on_api_response(self, response, *args, **kwargs):
+        """
+        Counts the HTTP responses of the Spotify Web API by endpoint, with the retries urllib3 made before them.
+
+        Called by requests in the worker threads, the counters are updated in the event loop thread.
+
+        Args:
+            response (requests.Response): The final response.
+        """
+        endpoint = f"{response.request.method} {SPOTIFY_ID.sub('/{id}', urlparse(response.url).path)}"
+        history = getattr(getattr(response.raw, "retries", None), "history", None) or ()
+        throttled = sum(1 for attempt in history if attempt.status == 429) + (response.status_code == 429)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._count_api_response, endpoint, response.status_code, len(history), throttled)
+        else:
+            self._count_api_response(endpoint, response.status_code, len(history), throttled)
+
+    def _count_api_response(self, endpoint, status, retries, throttled):
+        """
+        Counts a Spotify Web API response.
+
+        Args:
+            endpoint (str): The HTTP method and the path of the endpoint, with Spotify IDs replaced.
+            status (int): The HTTP status of the final response.
+            retries (int): The number of attempts urllib3 retried before it.
+            throttled (int): The number of responses with HTTP status 429, among the retried attempts and the final response.
+        """
+        self._metrics.inc("spotify_api_responses_total", endpoint, status)
+        if retries:
+            self._metrics.inc("spotify_api_retries_total", endpoint, amount=retries)
+        if throttled:
+            self._metrics.inc("spotify_api_throttled_total", endpoint, amount=throttled)
+
+    async def _set_loop_status(self, loop_status):
         """
         Sets the loop status for playback.
 
         Args:
             loop_status (str): The desired loop status, can be "none", "track", or "playlist".
         """
-        match loop_status:
-            case "none":
-                self._sp.repeat("off")
-            case "track":
-                self._sp.repeat("track")
-            case "playlist":
-                self._sp.repeat("context")
-
-    def _set_shuffle(self, shuffle):
+        try:
+            match loop_status:
+                case "none":
+                    await self._call(self._sp.repeat, "off")
+                case "track":
+                    await self._call(self._sp.repeat, "track")
+                case "playlist":
+                    await self._call(self._sp.repeat, "context")
+        except Exception:
+            self._rollback("loopStatus", loop_status)
+            raise
+
+    async def _set_shuffle(self, shuffle):
         """
         Sets the shuffle status for playback.
 
         Args:
             shuffle (bool): True to enable shuffle, False to disable.
         """
-        self._sp.shuffle(shuffle)
+        try:
+            await self._call(self._sp.shuffle, shuffle)
+        except Exception:
+            self._rollback("shuffle", shuffle)
+            raise
 
-    def _set_volume(self, volume):
+    async def _set_volume(self, volume):
         """
         Sets the volume for playback.
 
+        The value is expected again if its optimistic update is gone by the time it is sent, e.g. rolled
+        back after the previous value failed, so that it is rolled back in turn if it fails.
+
         Args:
             volume (int): The desired volume level, typically between 0 and 100.
         """
-        self._sp.volume(volume)
+        expected = self._expected.get("volume")
+        if (expected[0] if expected is not None else self._properties["volume"]) != volume:
+            self._expect("volume", volume)
+            self._send_properties()
+        try:
+            await self._call(self._sp.volume, volume)
+        except Exception:
+            self._rollback("volume", volume)
+            raise
 
-    def _play(self):
+    async def _play(self):
         """
         Starts playback using the Spotify client.
         """
-        self._sp.start_playback()
+        await self._set_playback_status("playing", self._sp.start_playback)
 
-    def _pause(self):
+    async def _pause(self):
         """
         Pauses the current playback using the Spotify client.
         """
-        self._sp.pause_playback()
+        await self._set_playback_status("paused", self._sp.pause_playback)
 
-    def _playPause(self, status):
+    async def _playPause(self, status):
         """
         Toggles playback state between 'playing' and 'paused'.
 
@@ -259,58 +1063,265 @@ class LibrespotControl(object):
         """
         match status:
             case "paused":
-                self._properties["playbackStatus"] = "playing"
-                self._sp.start_playback()
+                await self._play()
             case "playing":
-                self._properties["playbackStatus"] = "paused"
-                self._sp.pause_playback()
+                await self._pause()
+
+    async def _set_playback_status(self, status, method):
+        """
+        Calls the Spotify client, and rolls back the playback status shown since the command was received if it fails.
+
+        Args:
+            status (str): The expected playback status, "playing" or "paused".
+            method (callable): The Spotify client method.
+        """
+        try:
+            await self._call(method)
+        except Exception:
+            self._rollback("playbackStatus", status)
+            raise
 
-    def _next(self):
+    async def _next(self):
         """
         Skips to the next track in the playback queue using the underlying Spotify client.
         """
-        self._sp.next_track()
+        await self._call(self._sp.next_track)
 
-    def _previous(self):
+    async def _previous(self):
         """
         Skips to the previous track in the playback queue using the underlying Spotify client.
         """
-        self._sp.previous_track()
+        await self._call(self._sp.previous_track)
 
-    def _set_position(self, position):
+    async def _set_position(self, position):
         """
         Set the playback position of the current track.
 
         Args:
             position (float): The desired playback position in seconds.
         """
-        self._sp.seek_track(int (position * 1000))
-        self._properties["position"] = position
+        await self._call(self._sp.seek_track, int (max(0, position) * 1000))
 
-    def _seek(self, offset):
+    def _seek(self, position=None, offset=0):
         """
-        Adjusts the current playback position by a given offset.
+        Queues a seek, merged with the pending ones, and moves the local playback position to its target right away.
+
+        The new position is notified at once, so that Snapcast clients extrapolate from it rather than
+        from the previous one until librespot reports the seek.
 
         Args:
+            position (float): The desired playback position in seconds, None to seek relative to the current one.
             offset (int): The number of seconds to move the playback position forward or backward.
         """
-        self._set_position(self._properties["position"] + offset)
+        if position is None:
+            # The offset adds up with the pending ones, if any, otherwise it is relative to the current position
+            position = self._clock.now() + offset
+            self._seek_target.submit((None if self._seek_target.pending else self._clock.now(), offset))
+        else:
+            self._seek_target.submit((position, 0))
+        self._clock.update(max(0, position))
+        self._properties["position"] = self._clock.position
+        self._send_properties()
+
+    def _apply(self, key, value):
+        """
+        Sets a property, keeping the position clock in step with the playback status.
+
+        Args:
+            key (str): The name of the property.
+            value (Any): Its value.
+        """
+        if key == "playbackStatus":
+            self._update_state(value)
+        else:
+            self._properties[key] = value
+
+    def _expect(self, key, value):
+        """
+        Applies the expected outcome of a control command right away, until librespot confirms it.
+
+        The last confirmed value is kept to roll back to if the command fails. If librespot does not
+        confirm the update within CONFIRM_TIMEOUT, the property is resynchronized with Spotify.
+
+        Args:
+            key (str): The name of the property, "playbackStatus", "shuffle", "loopStatus" or "volume".
+            value (Any): The expected value.
+        """
+        confirmed = self._expected[key][1] if key in self._expected else self._properties.get(key)
+        if key in self._expected:
+            self._expected[key][2].cancel()
+        timer = self._loop.call_later(CONFIRM_TIMEOUT, self._on_confirm_timeout, key)
+        self._expected[key] = (value, confirmed, timer)
+        self._apply(key, value)
+
+    def _reconcile(self, key):
+        """
+        Reconciles an optimistic update with the value librespot just reported for its property.
+
+        The update is confirmed if the values match. Otherwise the reported value becomes the one to
+        roll back to, and the expected value is shown again until librespot catches up or the update times out.
+
+        Args:
+            key (str): The name of the property.
+        """
+        if key not in self._expected:
+            return
+        expected, _, timer = self._expected[key]
+        reported = self._properties[key]
+        if expected == reported or (key == "volume" and abs(expected - reported) <= 1):
+            timer.cancel()
+            del self._expected[key]
+        else:
+            self._expected[key] = (expected, reported, timer)
+            self._apply(key, expected)
+
+    def _rollback(self, key, value):
+        """
+        Restores the last confirmed value of a property after the command updating it failed.
+
+        Nothing is restored if a later command expects another value, its own outcome decides.
+
+        Args:
+            key (str): The name of the property.
+            value (Any): The value the failed command set.
+        """
+        if key not in self._expected or self._expected[key][0] != value:
+            return
+        _, confirmed, timer = self._expected.pop(key)
+        timer.cancel()
+        logger.debug(f"Rolling back {key} to {confirmed}")
+        self._apply(key, confirmed)
+        self._send_properties()
+
+    def _on_confirm_timeout(self, key):
+        """
+        Resynchronizes a property once its optimistic update timed out, after the pending commands.
+
+        Args:
+            key (str): The name of the property.
+        """
+        logger.debug(f"librespot did not confirm {key} within {CONFIRM_TIMEOUT} s")
+        self._spawn(None, self._resync(key))
+
+    async def _resync(self, key):
+        """
+        Resynchronizes a property librespot did not confirm in time with the playback state of Spotify.
+
+        Falls back to the last confirmed value if the playback state is not available.
+
+        Args:
+            key (str): The name of the property.
+        """
+        try:
+            playback = await self._api(self._sp.current_playback, "current_playback")
+        except Exception as e:
+            logger.warning(f"Failed to get the playback state: {e}")
+            playback = None
+        if key not in self._expected:
+            return
+        value = self._expected.pop(key)[1]
+        if playback:
+            match key:
+                case "playbackStatus":
+                    value = "playing" if playback["is_playing"] else "paused"
+                case "shuffle":
+                    value = playback["shuffle_state"]
+                case "loopStatus":
+                    value = LOOP_STATUS.get(playback["repeat_state"], value)
+                case "volume":
+                    value = (playback.get("device") or {}).get("volume_percent", value)
+        logger.debug(f"Resynchronizing {key} to {value}")
+        self._apply(key, value)
+        self._send_properties()
+
+    def _describe_metrics(self):
+        """
+        Declares the metrics, and registers the gauges read from the current state when they are scraped.
+        """
+        m = self._metrics
+        m.describe("librespot_events_total", "counter", "librespot events received, by type.", ("event",))
+        m.describe("librespot_events_stale_total", "counter", "librespot events superseded by events already applied, by type.", ("event",))
+        m.describe("event_to_notification_seconds", "histogram", "Time from the emission of a librespot event to the notification reflecting it.")
+        m.describe("jsonrpc_requests_total", "counter", "JSON-RPC requests received from snapserver, by method.", ("method",))
+        m.describe("jsonrpc_errors_total", "counter", "JSON-RPC requests answered with an error, by method.", ("method",))
+        m.describe("jsonrpc_request_seconds", "histogram", "Time from the receipt of a JSON-RPC request to its completion, by method.", ("method",))
+        m.describe("spotify_api_call_seconds", "histogram", "Duration of the Spotify Web API calls, retries included, by client method.", ("method",))
+        m.describe("spotify_api_errors_total", "counter", "Failed Spotify Web API calls, by client method and HTTP status.", ("method", "status"))
+        m.describe("spotify_api_responses_total", "counter", "Spotify Web API responses, by endpoint and HTTP status.", ("endpoint", "status"))
+        m.describe("spotify_api_retries_total", "counter", "Spotify Web API requests retried, by endpoint.", ("endpoint",))
+        m.describe("spotify_api_throttled_total", "counter", "Spotify Web API responses with HTTP status 429, by endpoint.", ("endpoint",))
+        m.describe("spotify_api_calls_in_flight", "gauge", "Spotify Web API calls running or waiting for a worker.")
+        m.gauge("spotify_api_calls_in_flight", lambda: self._api_in_flight)
+        m.describe("commands_in_flight", "gauge", "Control commands running or waiting for the previous ones.")
+        m.gauge("commands_in_flight", lambda: len(self._tasks))
+        m.describe("optimistic_updates_pending", "gauge", "Optimistic updates waiting for librespot to confirm them.")
+        m.gauge("optimistic_updates_pending", lambda: len(self._expected))
+        m.describe("output_queue_messages", "gauge", "JSON-RPC messages queued for snapserver.")
+        m.gauge("output_queue_messages", lambda: output.depth()[0] if output is not None else 0)
+        m.describe("output_buffer_bytes", "gauge", "Bytes written for snapserver but not read by it yet.")
+        m.gauge("output_buffer_bytes", lambda: output.depth()[1] if output is not None else 0)
+        m.describe("requests_collapsed_total", "counter", "Volume and seek requests merged into a later one.", ("kind",))
+        m.gauge("requests_collapsed_total", lambda: {("volume",): self._volume.collapsed, ("position",): self._seek_target.collapsed})
+        m.describe("notifications_total", "counter", "Properties notifications, by outcome.", ("outcome",))
+        m.gauge("notifications_total", lambda: {(outcome,): self._notifications[outcome] for outcome in ("sent", "suppressed")})
+        m.describe("metadata_cache_lookups_total", "counter", "Metadata cache lookups, by result.", ("result",))
+        m.gauge("metadata_cache_lookups_total", lambda: {(result,): count for result, count in self._cache.stats.items()} if self._cache is not None else {})
+        m.describe("metadata_prefetches_total", "counter", "Preloaded items, by state of their metadata when they became current: cached (hit), still looked up (late), not cached (miss), or never current (unused).", ("outcome",))
+        m.gauge("metadata_prefetches_total", lambda: {(outcome,): count for outcome, count in self._prefetches.items()} if self._cache is not None else {})
 
     def _send_properties(self):
         """
-        Sends the current playback properties as a JSON-RPC message.
+        Sends the current playback properties as a JSON-RPC message, if they changed since they were last sent.
 
         Constructs a message with the current properties and sends it using the `send` function.
         The message is formatted according to the JSON-RPC 2.0 specification.
+
+        Snapserver replaces all the properties of the stream with the notified ones, except the
+        metadata, which it keeps when they are omitted. Nothing is sent when nothing changed, and
+        the metadata are only sent when they changed. The position advancing while playing is not
+        a change, the notifications carry the extrapolated position, but moving to another timeline
+        is, even when the new anchor has the same position as the previous one.
         """
-        log(f'Properties: {self._properties}')
+        properties = {key: value for key, value in self._properties.items() if key not in ("metadata", "position")}
+        state = json.dumps([properties, self._clock.timeline()], sort_keys=True)
+        metadata = json.dumps(self._properties.get("metadata"), sort_keys=True)
+        if (state, metadata) == self._published:
+            self._notifications["suppressed"] += 1
+            self._unpublished.clear()
+            return
+        if metadata != self._published[1]:
+            properties = self._current_properties()
+        else:
+            properties = dict(properties, position=self._current_properties()["position"])
+            self._notifications["without_metadata"] += 1
+        self._published = (state, metadata)
+        self._notifications["sent"] += 1
+
+        self._trace.record("properties", properties)
+        if logger.isEnabledFor(logging.DEBUG):
+            log(f'Properties: {properties}')
         msg = {
             "jsonrpc": "2.0",
             "method": "Plugin.Stream.Player.Properties",
-            "params": self._properties
+            "params": properties
         }
         send(msg)
 
+        now = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+        for ts in self._unpublished:
+            self._metrics.observe("event_to_notification_seconds", max(0, now - ts) / 1e9)
+        self._unpublished.clear()
+
+    def _notification_stats(self):
+        """
+        Returns the notification counters, with the share of notifications that were suppressed because nothing changed.
+
+        Returns:
+            dict: The sent, suppressed and without_metadata counters, and the suppression_rate.
+        """
+        total = self._notifications["sent"] + self._notifications["suppressed"]
+        return dict(self._notifications, suppression_rate=self._notifications["suppressed"] / total if total else 0.0)
+
     def _get_properties(self, id):
         """
         Send the current properties.
@@ -318,9 +1329,46 @@ class LibrespotControl(object):
         Args:
             id: The identifier for the JSON-RPC request.
         """
-        send({ "id": id, "jsonrpc": "2.0", "result": self._properties } )
+        send({ "id": id, "jsonrpc": "2.0", "result": self._current_properties() } )
 
-    def _set_properties(self, id, params):
+    def _expect_properties(self, params):
+        """
+        Shows the properties of a SetProperties request right away, before the request waits for the previous commands.
+
+        Properties handled by Spotify are rolled back if the command fails.
+
+        Args:
+            params (dict): The properties to set, see `_set_properties`.
+        """
+        for key in ("loopStatus", "shuffle", "volume"):
+            if key in params:
+                self._expect(key, params[key])
+        self._properties.update({key: value for key, value in params.items() if key not in ("loopStatus", "shuffle", "volume")})
+        if "rate" in params:
+            self._clock.update()
+            self._clock.rate = float(params["rate"])
+            self._properties["position"] = self._clock.position
+        self._send_properties()
+
+    def _expect_control(self, command):
+        """
+        Shows the playback status a control command leads to right away, before the command waits for the previous commands.
+
+        Args:
+            command (str): The control command.
+
+        Returns:
+            str: The command to run, "playPause" being resolved against the playback status shown when it was received.
+        """
+        if command == "playPause":
+            command = {"paused": "play", "playing": "pause"}.get(self._properties["playbackStatus"], command)
+        status = {"play": "playing", "pause": "paused", "stop": "paused"}.get(command)
+        if status is not None:
+            self._expect("playbackStatus", status)
+            self._send_properties()
+        return command
+
+    async def _set_properties(self, id, params):
         """
         Sets properties based on the provided parameters and sends a response.
 
@@ -335,21 +1383,60 @@ class LibrespotControl(object):
                     "rate": float       # Playback rate (e.g., 1.0 for normal speed)
                 }
         """
-        self._properties.update(params)
         if "loopStatus" in params:
-            self._set_loop_status(params["loopStatus"])
+            await self._set_loop_status(params["loopStatus"])
         if "shuffle" in params:
-            self._set_shuffle(params["shuffle"])
+            await self._set_shuffle(params["shuffle"])
         if "volume" in params:
-            self._set_volume(params["volume"])
+            self._volume.submit(params["volume"])
 
         send({ "id": id, "jsonrpc": "2.0", "result": "ok" })
 
-    def _on_fifo_data(self, msg):
+    def _record_latency(self, ts):
+        """
+        Records the latency between the emission of an event by librespot and its processing.
+
+        Args:
+            ts (int): The CLOCK_MONOTONIC time at which librespot emitted the event, in nanoseconds.
+
+        Returns:
+            float: The latency, in milliseconds.
+        """
+        latency = (time.clock_gettime_ns(time.CLOCK_MONOTONIC) - ts) / 1e6
+        self._latency["count"] += 1
+        self._latency["total"] += latency
+        self._latency["max"] = max(self._latency["max"], latency)
+        return latency
+
+    def _is_fresh(self, group, ts):
+        """
+        Checks whether an event is newer than the last one applied to a group of properties, and records it if so.
+
+        Concurrent hooks may deliver events out of order: an event emitted before the last one applied
+        to the same properties is superseded. Playback events emitted before the last track change refer
+        to the previous track and are superseded as well.
+
+        Args:
+            group (str): The group of properties the event updates, e.g. "volume", "track", "state", "position" or "shuffle".
+            ts (int): The CLOCK_MONOTONIC time at which librespot emitted the event, in nanoseconds, or None if unknown.
+
+        Returns:
+            bool: True if the event must be applied to the group, False if it is superseded.
         """
-        Handles incoming FIFO data messages from librespot, parses the JSON payload, and updates internal state based on the event type.
+        if ts is None:
+            return True
+        if ts < self._emitted.get(group, 0) or (group in ("state", "position") and ts < self._emitted.get("track", 0)):
+            return False
+        self._emitted[group] = ts
+        return True
+
+    def _on_event(self, json_data):
+        """
+        Updates internal state based on a librespot event.
+
         Args:
-            msg (str): A JSON-formatted string containing event data from librespot.
+            json_data (dict): The event data sent by the librespot hook.
+
         Events handled:
             - "volume_changed": Updates the volume.
             - "playing": Updates position and sets state to "playing" if track ID matches.
@@ -358,36 +1445,54 @@ class LibrespotControl(object):
             - "end_of_track" or "stopped": Sets state to "stopped" if track ID matches.
             - "track_changed": Updates track information.
             - "episode_changed": Updates episode information.
+            - "preload_next" or "preloading": Warms the metadata cache with the next item.
+            - "shuffle_changed": Updates the shuffle status.
+            - "repeat_changed": Updates the loop status.
+            - "session_disconnected": Sets state to "stopped" and forgets the session.
+            - "session_connected", "session_client_changed", "auto_play_changed",
+              "filter_explicit_content_changed" or "sink": Updates the session state.
             - Any unknown event: Logs a debug message.
-        After handling the event, sends updated properties.
+
+        Returns:
+            bool: False if the event was superseded by events already applied, True otherwise.
         """
-        json_data = json.loads(msg)
-        if "event" in json_data:
-            event = json_data["event"]
+        event = json_data["event"]
+        ts = json_data.get("ts")
+        fresh = True
 
-            match event:
-                case "volume_changed":
+        match event:
+            case "volume_changed":
+                if fresh := self._is_fresh("volume", ts):
                     self._update_volume(int(json_data["volume"]) / 65535.0 * 100.0)
-                
-                case "playing":
-                    if self._check_track_id(json_data["track_id"]):
-                        self._update_position(int(json_data["position_ms"]))
-                        self._update_state("playing")
-
-                case "paused":
-                    if self._check_track_id(json_data["track_id"]):
-                        self._update_position(int(json_data["position_ms"]))
-                        self._update_state("paused")
-
-                case "seeked" | "position_correction":
-                    if self._check_track_id(json_data["track_id"]):
-                        self._update_position(int(json_data["position_ms"]))
-
-                case "end_of_track" | "stopped":
-                    if self._check_track_id(json_data["track_id"]):
-                        self._update_state("stopped")
-
-                case "track_changed":
+                    self._reconcile("volume")
+            
+            case "playing" | "paused":
+                if self._check_track_id(json_data["track_id"]):
+                    position = self._is_fresh("position", ts)
+                    state = self._is_fresh("state", ts)
+                    if position:
+                        self._update_position(int(json_data["position_ms"]), ts)
+                    if state:
+                        self._update_state(event, ts)
+                        self._reconcile("playbackStatus")
+                    fresh = position or state
+
+            case "seeked" | "position_correction":
+                if self._check_track_id(json_data["track_id"]):
+                    if fresh := self._is_fresh("position", ts):
+                        if event == "position_correction" and self._clock.playing:
+                            drift = self._clock.correct(int(json_data["position_ms"]) / 1000.0, ts / 1e9 if ts is not None else None)
+                            logger.debug("Position drift: %.1f ms", drift * 1000.0)
+                        self._update_position(int(json_data["position_ms"]), ts)
+
+            case "end_of_track" | "stopped":
+                if self._check_track_id(json_data["track_id"]):
+                    if fresh := self._is_fresh("state", ts):
+                        self._update_state("stopped", ts)
+                        self._reconcile("playbackStatus")
+
+            case "track_changed":
+                if fresh := self._is_fresh("track", ts):
                     self._update_track(
                         json_data["track_id"],
                         json_data["name"],
@@ -399,7 +1504,8 @@ class LibrespotControl(object):
                         json_data["covers"]
                     )
 
-                case "episode_changed":
+            case "episode_changed":
+                if fresh := self._is_fresh("track", ts):
                     self._update_episode(
                         json_data["track_id"],
                         json_data["name"],
@@ -407,14 +1513,128 @@ class LibrespotControl(object):
                         json_data["uri"]
                     )
 
-                case _:
-                    logger.debug(f"Unknown librespot event: {event}")
-            
-            self._send_properties()
+            case "preload_next" | "preloading":
+                self._prefetch(json_data["track_id"])
+
+            case "shuffle_changed":
+                if fresh := self._is_fresh("shuffle", ts):
+                    self._update_shuffle(json_data["shuffle"])
+                    self._reconcile("shuffle")
+
+            case "repeat_changed":
+                if fresh := self._is_fresh("loop", ts):
+                    self._update_loop_status(json_data["repeat"], json_data["repeat_track"])
+                    self._reconcile("loopStatus")
+
+            case "session_connected":
+                if fresh := self._is_fresh("session", ts):
+                    self._update_session(user_name=json_data["user_name"], connection_id=json_data["connection_id"])
+
+            case "session_disconnected":
+                if fresh := self._is_fresh("session", ts):
+                    self._session.clear()
+                    if self._is_fresh("state", ts):
+                        self._update_state("stopped", ts)
+                        self._reconcile("playbackStatus")
+
+            case "session_client_changed":
+                if fresh := self._is_fresh("client", ts):
+                    self._update_session(
+                        client_id=json_data["client_id"],
+                        client_name=json_data["client_name"],
+                        client_brand_name=json_data["client_brand_name"],
+                        client_model_name=json_data["client_model_name"]
+                    )
+
+            case "auto_play_changed":
+                if fresh := self._is_fresh("auto_play", ts):
+                    self._update_session(auto_play=json_data["auto_play"])
+
+            case "filter_explicit_content_changed":
+                if fresh := self._is_fresh("filter", ts):
+                    self._update_session(filter_explicit_content=json_data["filter"])
+
+            case "sink":
+                if fresh := self._is_fresh("sink", ts):
+                    self._update_session(sink_status=json_data["sink_status"])
+
+            case _:
+                logger.debug("Unknown librespot event: %s", event)
+
+        return fresh
+
+    def _handle_fifo_data(self, msg):
+        """
+        Handles an incoming FIFO data message from librespot, parses the JSON payload, and updates internal state based on the event type.
+
+        Events larger than PIPE_BUF arrive as fragments and are handled once reassembled. Events already
+        replayed from the journal are ignored, the others are acknowledged in the journal once handled.
+
+        Args:
+            msg (str): A JSON-formatted string containing event data from librespot, or a fragment of it.
+
+        Returns:
+            bool: True if the event was applied and the properties must be sent, False otherwise.
+        """
+        if msg.startswith(FRAGMENT_PREFIX):
+            msg = self._reassembler.feed(msg)
+            if msg is None:
+                return False
+
+        json_data = json.loads(msg)
+        if "event" in json_data:
+            seq = json_data.get("seq")
+            if seq is not None and seq <= self._replayed_seq:
+                self._trace.record("replayed", json_data["event"], seq)
+                return False
+
+            latency = self._record_latency(json_data["ts"]) if "ts" in json_data else None
+
+            self._metrics.inc("librespot_events_total", json_data["event"])
+            fresh = self._on_event(json_data)
+            self._trace.record("event", json_data["event"], seq, latency, "fresh" if fresh else "superseded")
+            if fresh and "ts" in json_data:
+                self._unpublished.append(json_data["ts"])
+
+            if seq is not None and self._journal is not None:
+                self._journal.ack(seq)
+            if not fresh:
+                self._stale_events += 1
+                self._metrics.inc("librespot_events_stale_total", json_data["event"])
+            return fresh
         else:
             logger.debug(f"Unknown librespot message: {msg}")
+            return False
 
-    def _control(self, id, params):
+    def _on_fifo_data(self, msg):
+        """
+        Handles an incoming FIFO data message from librespot and sends the updated properties.
+
+        Args:
+            msg (str): A JSON-formatted string containing event data from librespot, or a fragment of it.
+        """
+        if self._handle_fifo_data(msg):
+            self._send_properties()
+
+    def _on_fifo_batch(self, messages):
+        """
+        Handles every FIFO data message received in one wakeup, then sends the updated properties once.
+
+        A burst of librespot events thus costs a single notification, reflecting the state after the last of them.
+
+        Args:
+            messages (list): The JSON-formatted strings received, in order.
+        """
+        changed = False
+        for msg in messages:
+            try:
+                changed |= self._handle_fifo_data(msg)
+            except Exception as e:
+                logger.warning(f"Failed to handle librespot message {msg[:64]}: {e}")
+        if changed:
+            self._send_properties()
+
+    async def _control(self, id, params):
         """
         Handles playback control commands by dispatching actions based on the provided command in params.
 
@@ -430,41 +1650,77 @@ class LibrespotControl(object):
         Supported commands:
             - "play": Starts playback.
             - "pause" or "stop": Pauses playback.
-            - "playPause": Toggles playback state based on current status.
+            - "playPause": Toggles playback state based on current status, usually resolved into "play" or "pause" by `_expect_control` already.
             - "next": Skips to the next track.
             - "previous": Returns to the previous track.
-            - "setPosition": Sets playback position (requires "position" in params).
-            - "seek": Seeks by an offset (requires "offset" in params).
 
-        Responds with "ok" upon handling the command.
+        Responds with "ok" upon handling the command. The "setPosition" and "seek" commands are
+        coalesced and acknowledged right away by `_on_stdin_data` instead.
         """
         match params["command"]:
             case "play":
-                self._play()
+                await self._play()
 
             case "pause" | "stop":
-                self._pause()
+                await self._pause()
 
             case "playPause":
-                self._playPause(self._properties["playbackStatus"])
+                await self._playPause(self._properties["playbackStatus"])
 
             case "next":
-                self._next()
+                await self._next()
 
             case "previous":
-                self._previous()
-
-            case "setPosition":
-                self._set_position(params["params"]["position"])
-
-            case "seek":
-                self._seek(params["params"]["offset"])
+                await self._previous()
 
             case _:
                 logger.debug(f"Unknwon command {params['command']}")
 
         send({"id": id, "jsonrpc": "2.0", "result": "ok"})
 
+    async def _command(self, id, coro, method=None, start=None):
+        """
+        Runs a control command once the previous ones are done, so that commands reach the device in the order they were issued.
+
+        All the commands target the same device, the configured one or the active one. A command that fails is answered with a JSON-RPC error of its own, which carries the HTTP
+        status of the Spotify Web API response if there was one.
+
+        Args:
+            id (Any): The identifier for the request, used in the error response, or None if the command has no request of its own.
+            coro (coroutine): The command, which sends its own response when it succeeds.
+            method (str): The JSON-RPC method of the request, used as metric label.
+            start (float): The time.perf_counter() value at which the request was received.
+        """
+        # asyncio locks are fair: waiting commands acquire the lock in the order they asked for it
+        async with self._commands:
+            try:
+                await coro
+            except Exception as e:
+                logger.warning(f"Spotify command {id} failed: {e}")
+                self._trace.record("failed", id, method, e)
+                error = {"code": -32000, "message": str(e)}
+                if getattr(e, "http_status", None) is not None:
+                    error["data"] = {"http_status": e.http_status}
+                if id is not None:
+                    send({"id": id, "jsonrpc": "2.0", "error": error})
+                self._metrics.inc("jsonrpc_errors_total", method or "internal")
+        if method is not None:
+            self._metrics.observe("jsonrpc_request_seconds", time.perf_counter() - start, method)
+
+    def _spawn(self, id, coro, method=None, start=None):
+        """
+        Runs a control command as a task, concurrently with the handling of librespot events and Snapcast requests.
+
+        Args:
+            id (Any): The identifier for the request.
+            coro (coroutine): The command.
+            method (str): The JSON-RPC method of the request, if any.
+            start (float): The time.perf_counter() value at which the request was received.
+        """
+        task = self._loop.create_task(self._command(id, coro, method, start))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
     def _on_stdin_data(self, msg):
         """
         Handles incoming data from standard input, parses it as JSON, and processes requests.
@@ -475,36 +1731,135 @@ class LibrespotControl(object):
         Plugin.Stream.Player.Control and Plugin.Stream.Player.SetProperty methods are not expected
         because canControl is set to False.
 
+        A message that is not valid JSON is logged and ignored, a request that cannot be handled, e.g.
+        because of missing parameters, is answered with a JSON-RPC error. Neither stops the handling
+        of the next messages.
+
         Args:
             data (str): The raw JSON string received from standard input.
         """
-        json_data = json.loads(msg)
-        if "id" in json_data and "method" in json_data:
+        start = time.perf_counter()
+        try:
+            json_data = json.loads(msg)
+        except ValueError as e:
+            logger.warning(f"Invalid snapcast message {msg[:64]}: {e}")
+            return
+        if isinstance(json_data, dict) and "id" in json_data and isinstance(json_data.get("method"), str):
             id = json_data["id"]
-            match json_data["method"]:
-                case "Plugin.Stream.Player.GetProperties":
-                    self._get_properties(id)
-                case "Plugin.Stream.Player.SetProperties":
-                    self._set_properties(id, json_data["params"])
-                case "Plugin.Stream.Player.Control":
-                    self._control(id, json_data["params"])
-                case _:
-                    logger.debug(f"Unsupported snapcast request: {json_data['method']}")
+            method = json_data["method"]
+            self._metrics.inc("jsonrpc_requests_total", method)
+            self._trace.record("request", id, method, json_data.get("params"))
+            try:
+                self._handle_request(id, method, json_data, start)
+            except Exception as e:
+                logger.warning(f"Failed to handle snapcast request {id} ({method}): {e!r}")
+                self._trace.record("failed", id, method, e)
+                send({"id": id, "jsonrpc": "2.0", "error": {"code": -32602, "message": f"Invalid params: {e!r}"}})
+                self._metrics.inc("jsonrpc_errors_total", method)
         else:
             logger.debug(f"Unknown snapcast message: {msg}")
 
-    def run(self):
+    def _handle_request(self, id, method, json_data, start):
         """
-        Waits for data from either a named pipe or standard input and processes it accordingly.
+        Handles a JSON-RPC request from snapserver.
 
-        This method opens a named pipe for reading and sends a JSON-RPC notification indicating that the stream is ready.
-        It then enters a loop, monitoring both the pipe and standard input for incoming data using the `select` module.
-        When data is available from the pipe, it is read, stripped of leading/trailing whitespace, and passed to the `_on_fifo_data` handler.
-        When data is available from standard input, it is similarly read, stripped, and passed to the `_on_stdin_data` handler.
-        The loop continues until interrupted by a KeyboardInterrupt, at which point the method exits gracefully.
+        Args:
+            id (Any): The identifier for the request.
+            method (str): The JSON-RPC method of the request.
+            json_data (dict): The request.
+            start (float): The time.perf_counter() value at which the request was received.
+        """
+        match method:
+            case "Plugin.Stream.Player.GetProperties":
+                self._get_properties(id)
+            case "Plugin.Stream.Player.SetProperties" if json_data["params"].keys() == {"volume"}:
+                # Volume changes are acknowledged right away, and coalesced before reaching Spotify
+                self._expect("volume", json_data["params"]["volume"])
+                self._send_properties()
+                self._volume.submit(json_data["params"]["volume"])
+                send({"id": id, "jsonrpc": "2.0", "result": "ok"})
+            case "Plugin.Stream.Player.Control" if json_data["params"]["command"] in ("setPosition", "seek"):
+                # So are seeks, only the final target of a scrub reaches Spotify
+                command = json_data["params"]
+                if command["command"] == "setPosition":
+                    self._seek(position=command["params"]["position"])
+                else:
+                    self._seek(offset=command["params"]["offset"])
+                send({"id": id, "jsonrpc": "2.0", "result": "ok"})
+            case "Plugin.Stream.Player.SetProperties":
+                # The expected outcome is shown right away, even if the command has to wait for the previous ones
+                self._expect_properties(json_data["params"])
+                self._spawn(id, self._set_properties(id, json_data["params"]), method, start)
+                return
+            case "Plugin.Stream.Player.Control":
+                command = self._expect_control(json_data["params"]["command"])
+                self._spawn(id, self._control(id, dict(json_data["params"], command=command)), method, start)
+                return
+            case _:
+                logger.debug(f"Unsupported snapcast request: {json_data['method']}")
+        self._metrics.observe("jsonrpc_request_seconds", time.perf_counter() - start, method)
+
+    def _dump_trace(self):
+        """
+        Writes the trace to the log, e.g. on SIGUSR1.
+        """
+        logger.info("Trace:\n" + "\n".join(self._trace.dump()))
+
+    def _replay_journal(self):
         """
-        fifo_path = Path(params['librespot_fifo'])
+        Rebuilds the playback state from the events retained in the journal.
+
+        Events up to the last acknowledged sequence number were already handled by a previous
+        instance of the plugin and rebuild its state, the following ones were missed while it was
+        not running. Every retained event is replayed in order, without any Spotify Web API call,
+        and the properties are sent once. Only the item that is current at the end is enriched, from
+        the metadata cache or by a single lookup, and only the item preloaded after it is prefetched. The dropped/spooled counters maintained by the hooks are logged.
+        """
+        try:
+            self._journal = Journal(params['librespot_journal'])
+        except OSError as e:
+            logger.warning(f"Failed to open journal {params['librespot_journal']}: {e}")
+            return
+
+        acked, records = self._journal.records()
+        self._replay = {}
+        try:
+            for seq, payload in records:
+                try:
+                    self._on_event(json.loads(payload))
+                except Exception as e:
+                    logger.warning(f"Failed to replay journaled event {seq}: {e}")
+                self._replayed_seq = seq
+        finally:
+            replay, self._replay = self._replay, None
+        if "enrich" in replay:
+            self._enrich(*replay["enrich"])
+        if "prefetch" in replay:
+            self._prefetch(replay["prefetch"])
+
+        if records:
+            self._journal.ack(self._replayed_seq)
+            self._send_properties()
 
+        missed = sum(1 for seq, _ in records if seq > acked)
+        logger.info(f"Replayed {len(records)} journaled events, {missed} missed")
+
+        try:
+            with open(f"{parse_endpoint(params['librespot_fifo'])[1]}.stats") as stats:
+                logger.info(f"Hook counters: {json.load(stats)}")
+        except (OSError, ValueError):
+            pass
+
+    def _open_fifo(self, fifo_path):
+        """
+        Opens the named pipe librespot events are read from, creating it if needed.
+
+        Args:
+            fifo_path (Path): The file system path to the named pipe.
+
+        Returns:
+            tuple: The non-blocking file descriptor of the pipe, opened for reading, and the file descriptor of its keep-alive writer or None.
+        """
         if not fifo_path.exists():
             try:
                 os.mkfifo(fifo_path)
@@ -520,26 +1875,188 @@ class LibrespotControl(object):
             logger.error(f"FIFO {fifo_path} is not readable.")
             sys.exit(1)    
 
-        with open(fifo_path, 'r', opener=opener) as fifo:
+        fifo = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        return fifo, open_keepalive(fifo_path)
+
+    def _subscribe(self, bus_path):
+        """
+        Subscribes to the bus librespot events are published on.
+
+        Args:
+            bus_path (str): The file system path to the bus directory.
+
+        Returns:
+            Subscriber: The subscription.
+        """
+        try:
+            return Subscriber(BUS_SUBSCRIBER, bus_path)
+        except OSError as e:
+            logger.error(f"Failed to subscribe to bus {bus_path}: {e}")
+            sys.exit(1)
+
+    def _listen(self, kind, socket_path):
+        """
+        Listens for librespot events on a Unix socket.
+
+        Args:
+            kind (str): The type of the socket, "seqpacket" or "dgram".
+            socket_path (str): The file system path to bind the socket to.
+
+        Returns:
+            Listener: The listening socket.
+        """
+        try:
+            return Listener(kind, socket_path)
+        except OSError as e:
+            logger.error(f"Failed to listen on {kind} socket {socket_path}: {e}")
+            sys.exit(1)
+
+    def _on_receiver_readable(self, receiver):
+        """
+        Handles every event ready on the bus or the socket.
+
+        Args:
+            receiver (Subscriber | Listener): The bus subscription or the listening socket.
+        """
+        messages = [message.decode() for message in receiver.recv()]
+        # Fragments end with a newline, their data may end or start with whitespace
+        self._on_fifo_batch([message[:-1] if message.startswith(FRAGMENT_PREFIX) else message.strip() for message in messages])
+
+    def _on_fifo_readable(self, fifo_path, framer):
+        """
+        Handles every complete line available from the named pipe as a batch.
+
+        Args:
+            fifo_path (Path): The file system path to the named pipe, to reopen it at end-of-file.
+            framer (LineFramer): The framer of the pipe.
+        """
+        data, eof = read_available(self._fifo)
+        self._on_fifo_batch(framer.feed(data))
+        if eof and self._keepalive is None:
+            # Every writer has closed the pipe: a fresh read end is not readable until the next one
+            self._loop.remove_reader(self._fifo)
+            os.close(self._fifo)
+            self._fifo = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+            self._loop.add_reader(self._fifo, self._on_fifo_readable, fifo_path, framer)
+
+    def _on_stdin_readable(self, stdin, framer, stopped):
+        """
+        Handles every complete request available from standard input.
+
+        Args:
+            stdin (int): The file descriptor of standard input.
+            framer (LineFramer): The framer of standard input.
+            stopped (asyncio.Future): Resolved when snapserver closes standard input.
+        """
+        # Requests are answered chunk by chunk, the first ones need not wait for the whole burst to be read
+        while (data := read_chunk(stdin)):
+            for msg in framer.feed(data):
+                self._on_stdin_data(msg)
+        if data is not None:
+            logger.debug('Standard input closed')
+            self._loop.remove_reader(stdin)
+            if not stopped.done():
+                stopped.set_result(None)
+
+    async def _run(self):
+        """
+        Runs the plugin on an asyncio event loop until snapserver closes standard input.
+
+        The pipe (or the bus or socket) and standard input are watched with `add_reader`, and their
+        callbacks never block: control commands run as tasks, and their Spotify Web API calls run in
+        a small worker pool, so that librespot events and Snapcast requests (GetProperties is answered
+        from memory) keep flowing while a command is in flight. Messages to snapserver go through a
+        non-blocking `Writer`, so that the plugin never blocks when snapserver is slow to read them.
+        """
+        global output
+
+        self._loop = asyncio.get_running_loop()
+        output = Writer(sys.stdout.fileno(), self._loop)
+        self._executor = ThreadPoolExecutor(max_workers=params['spotify_workers'], thread_name_prefix='spotify')
+        metrics_server = None
+        if params['metrics']:
             try:
-                logger.debug(f'Ready')
-                send({"jsonrpc": "2.0", "method": "Plugin.Stream.Ready"})
-                while True:
-                    rlist, _, _ = select.select([fifo, sys.stdin], [], [])
-                    for r in rlist:
-                        if r is fifo:
-                            line = fifo.readline()
-                            if line:
-                                self._on_fifo_data(line.strip())
-                        elif r is sys.stdin:
-                            line = sys.stdin.readline()
-                            if line:
-                                self._on_stdin_data(line.strip())
-            except KeyboardInterrupt:
-                pass
-            finally:
-                fifo.close()
-                logger.debug('Exiting.')
+                metrics_server = await serve_metrics(self._metrics, params['metrics'], {"/trace": lambda: "\n".join(self._trace.dump()) + "\n"})
+                logger.info(f"Serving metrics on {params['metrics']}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to serve metrics on {params['metrics']}: {e}")
+
+        scheme, path = parse_endpoint(params['librespot_fifo'])
+        fifo_path = Path(path)
+
+        receiver = None
+        if scheme == "bus":
+            receiver = self._subscribe(path)
+        elif scheme in SOCKET_TYPES:
+            receiver = self._listen(scheme, path)
+        else:
+            self._fifo, self._keepalive = self._open_fifo(fifo_path)
+        stdin = sys.stdin.fileno()
+        os.set_blocking(stdin, False)
+        stopped = self._loop.create_future()
+        try:
+            logger.debug(f'Ready')
+            send({"jsonrpc": "2.0", "method": "Plugin.Stream.Ready"})
+            self._replay_journal()
+            if receiver is not None:
+                self._loop.add_reader(receiver, self._on_receiver_readable, receiver)
+            else:
+                self._loop.add_reader(self._fifo, self._on_fifo_readable, fifo_path, LineFramer())
+            self._loop.add_reader(stdin, self._on_stdin_readable, stdin, LineFramer(), stopped)
+            self._loop.add_signal_handler(signal.SIGUSR1, self._dump_trace)
+            await stopped
+        finally:
+            self._loop.remove_signal_handler(signal.SIGUSR1)
+            self._loop.remove_reader(stdin)
+            for task in list(self._tasks) + list(self._lookups.values()):
+                task.cancel()
+            if self._keepalive is not None:
+                os.close(self._keepalive)
+            if self._fifo is not None:
+                self._loop.remove_reader(self._fifo)
+                os.close(self._fifo)
+            if receiver is not None:
+                self._loop.remove_reader(receiver)
+                receiver.close()
+            if self._journal is not None:
+                self._journal.close()
+            if metrics_server is not None:
+                metrics_server.close()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            output.close()
+            logger.info(f"Output: {output.stats}")
+            output = None
+            logger.info(f"Collapsed requests: volume {self._volume.collapsed}, position {self._seek_target.collapsed}")
+            logger.info(f"Notifications: {self._notification_stats()}")
+            if self._cache is not None:
+                used = self._prefetches["hit"] + self._prefetches["late"] + self._prefetches["miss"]
+                hit_rate = f"{self._prefetches['hit'] / used * 100.0:.0f}%" if used else "n/a"
+                logger.info(f"Prefetches: {self._prefetches}, hit rate {hit_rate}")
+            drift = self._clock.drift
+            if drift["count"]:
+                logger.info(f"Position drift: average {drift['total'] / drift['count'] * 1000.0:.1f} ms, max {drift['max'] * 1000.0:.1f} ms over {drift['count']} corrections")
+
+    def run(self):
+        """
+        Waits for data from either a named pipe, a bus, or standard input and processes it accordingly.
+
+        This method opens a named pipe for reading, subscribes to a bus if the endpoint is prefixed with "bus:", or listens
+        on a Unix socket if it is prefixed with "seqpacket:" or "dgram:", and sends a JSON-RPC notification indicating that the stream is ready.
+        It then runs an asyncio event loop, monitoring both the pipe and standard input for incoming data.
+        When events are available on the bus or the socket, all of them are passed to the `_on_fifo_batch` handler.
+        When data is available from the pipe, everything available is read into a `LineFramer`, and every complete line
+        it yields is passed to the `_on_fifo_batch` handler at once, so a burst of events costs a single wakeup.
+        When data is available from standard input, it is similarly framed, and each line is passed to the `_on_stdin_data` handler.
+        A keep-alive writer is held on the pipe so that it never reads as end-of-file between two librespot events. If it
+        cannot be opened, the pipe is reopened whenever end-of-file is reached instead, so the loop never spins on it.
+        The loop continues until snapserver closes standard input or until interrupted by a KeyboardInterrupt, at which point the method exits gracefully.
+        """
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.debug('Exiting.')
 
 #def usage(params):
 #    print("""\
@@ -559,11 +2076,19 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]))
 
     parser.add_argument('-c', '--config', default=params['config'], help='Set configuration file (default: %(default)s)')
-    parser.add_argument('--librespot-fifo', default=params['librespot_fifo'], help='Set the fifo to read from (default: %(default)s)')
+    parser.add_argument('-i', '--instance', default=params['instance'], help='Set the librespot instance to read events from (default: %(default)s)')
+    parser.add_argument('--librespot-fifo', default=params['librespot_fifo'], help='Set the fifo to read from, bus:DIR to subscribe to an event bus, or seqpacket:PATH or dgram:PATH to listen on a Unix socket (default: derived from the instance)')
+    parser.add_argument('--librespot-journal', default=params['librespot_journal'], help='Set the journal to replay events from (default: derived from the instance)')
     parser.add_argument('--spotify-client-id', default=params['spotify_client_id'], help='Set the Spotify client ID (default: %(default)s)')
     parser.add_argument('--spotify-client-secret', default=params['spotify_client_secret'], help='Set the Spotify client secret (default: %(default)s)')
     parser.add_argument('--spotify-redirect-uri', default=params['spotify_redirect_uri'], help='Set the Spotify redirect URI (default: %(default)s)')
     parser.add_argument('--spotify-credentials-file', default=params['spotify_credentials_file'], help='Set the Spotify credentials file path (default: %(default)s)')
+    parser.add_argument('--spotify-device-id', default=params['spotify_device_id'], help='Set the Spotify Connect device to control (default: the active device)')
+    parser.add_argument('--spotify-workers', type=int, default=params['spotify_workers'], help='Set the number of threads making Spotify Web API calls (default: %(default)s)')
+    parser.add_argument('--metrics', default=params['metrics'], help='Serve Prometheus metrics over HTTP on PORT, HOST:PORT or unix:PATH, and the trace on /trace (default: disabled)')
+    parser.add_argument('--trace-size', type=int, default=params['trace_size'], help='Set the number of records kept in the trace, dumped on SIGUSR1, 0 to disable it (default: %(default)s)')
+    parser.add_argument('--enrich-metadata', action='store_true', help='Complete the track and episode metadata (release date, genres, artwork...) with the Spotify Web API')
+    parser.add_argument('--metadata-cache', default=params['metadata_cache'], help='Set the directory caching the enriched metadata (default: %(default)s)')
     parser.add_argument('--snapcast-host', default=params['snapcast_host'], help='Set the snapcast server address (default: %(default)s)')
     parser.add_argument('--snapcast-port', type=int, default=params['snapcast_port'], help='Set the snapcast server port (default: %(default)s)')
     parser.add_argument('--stream', default=params['stream'], help='Set the stream id')
@@ -587,10 +2112,15 @@ if __name__ == "__main__":
             if attr is not None and attr != parser.get_default(key):
                 params[key] = attr
 
+    # Each librespot instance has its own endpoints unless they are explicitly set
+    if not params['librespot_fifo']:
+        params['librespot_fifo'] = instance_path(FIFO_PATH, params['instance'])
+    if not params['librespot_journal']:
+        params['librespot_journal'] = instance_path(JOURNAL_PATH, params['instance'])
+
     log_handler = logging.StreamHandler()
     log_handler.setFormatter(logging.Formatter('%(asctime)s %(module)s %(levelname)s: %(message)s'))
 
-    logger = logging.getLogger('meta_librespot')
     logger.propagate = False
     logger.setLevel(logging.INFO if not args.debug else logging.DEBUG)
     logger.addHandler(log_handler)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Counters and latency histograms of meta_librespot.py, in the Prometheus text exposition format.
+#
+# Recording a sample is a dictionary update keyed by the label values, nothing is formatted until
+# the metrics are scraped. Samples are recorded from the event loop thread only, without locking.
+# Gauges such as queue depths are not recorded at all: they are read from callbacks when scraped.
+# The metrics are served over HTTP, on a TCP port or on a Unix socket, e.g.
+#     curl --unix-socket /tmp/meta_librespot.metrics http://localhost/metrics
+
+import time
+import bisect
+import asyncio
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = "meta_librespot_"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_labels(labels):
+    """
+    Formats the labels of a sample.
+
+    Args:
+        labels (tuple): The (name, value) pairs of the labels.
+
+    Returns:
+        str: The labels between braces, or an empty string if there are none.
+    """
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+def parse_address(address):
+    """
+    Splits the address to serve the metrics on into its transport and its location.
+
+    Args:
+        address (str): "unix:PATH", "HOST:PORT" or "PORT".
+
+    Returns:
+        tuple: ("unix", path) or ("tcp", (host, port)).
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "localhost", int(port))
+
+class Histogram(object):
+
+    def __init__(self):
+        """
+        Initializes a cumulative histogram with the BUCKETS upper bounds.
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Records a sample.
+
+        Args:
+            value (float): The sample, in seconds.
+        """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+class Registry(object):
+
+    def __init__(self):
+        """
+        Initializes an empty set of metrics.
+
+        Counters and histograms must only be updated from the thread running the event loop.
+        """
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._help = {}
+
+    def describe(self, name, kind, text, labels=()):
+        """
+        Declares a metric, so that it is listed with its type and help text even before it has samples.
+
+        Args:
+            name (str): The name of the metric, without the common prefix.
+            kind (str): "counter", "histogram" or "gauge".
+            text (str): The help text.
+            labels (tuple): The names of the labels, whose values are passed in this order when recording samples.
+        """
+        self._help[name] = (kind, text, labels)
+
+    def inc(self, name, *labels, amount=1):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): The name of the counter.
+            *labels: The values of the labels of the sample.
+            amount (float): The increment.
+        """
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, *labels):
+        """
+        Records a sample in a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            value (float): The sample, in seconds.
+            *labels: The values of the labels of the sample.
+        """
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, callback):
+        """
+        Registers a gauge, read when the metrics are scraped.
+
+        Args:
+            name (str): The name of the gauge.
+            callback (callable): Returns the value of the gauge, or a dictionary of values by tuple of label values.
+        """
+        self._gauges[name] = callback
+
+    def render(self):
+        """
+        Formats every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        names = lambda name: self._help.get(name, (None, None, ()))[2]
+
+        samples = {}
+        for (name, values), value in self._counters.items():
+            labels = tuple(zip(names(name), values))
+            samples.setdefault(name, []).append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+        for (name, values), histogram in self._histograms.items():
+            labels = tuple(zip(names(name), values))
+            counts, total = histogram.counts, histogram.sum
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{PREFIX}{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {cumulative}")
+        for name, callback in self._gauges.items():
+            value = callback()
+            if isinstance(value, dict):
+                samples[name] = [f"{PREFIX}{name}{format_labels(tuple(zip(names(name), values)))} {v}" for values, v in value.items()]
+            else:
+                samples[name] = [f"{PREFIX}{name} {value}"]
+
+        output = []
+        for name in sorted(set(samples) | set(self._help)):
+            if name in self._help:
+                kind, text, _ = self._help[name]
+                output.append(f"# HELP {PREFIX}{name} {text}")
+                output.append(f"# TYPE {PREFIX}{name} {kind}")
+            output.extend(samples.get(name, ()))
+        return "\n".join(output) + "\n"
+
+    def time(self, name, *labels):
+        """
+        Returns a context manager recording the time spent in its block in a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            *labels: The values of the labels of the sample.
+        """
+        return Timer(self, name, labels)
+
+class Timer(object):
+
+    def __init__(self, registry, name, labels):
+        """
+        Initializes a context manager recording the time spent in its block in a histogram.
+
+        Args:
+            registry (Registry): The metrics.
+            name (str): The name of the histogram.
+            labels (tuple): The values of the labels of the sample.
+        """
+        self._registry = registry
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._registry.observe(self._name, time.perf_counter() - self._start, *self._labels)
+        return False
+
+async def serve(registry, address, pages=None):
+    """
+    Serves the metrics over HTTP.
+
+    Every request is answered with the metrics, unless its path is one of the extra pages, and the connection is closed.
+
+    Args:
+        registry (Registry): The metrics.
+        address (str): "unix:PATH", "HOST:PORT" or "PORT".
+        pages (dict): Extra plain text pages, the callables returning them by path, e.g. {"/trace": ...}.
+
+    Returns:
+        asyncio.Server: The server, to close when exiting.
+    """
+    async def handle(reader, writer):
+        try:
+            request = (await asyncio.wait_for(reader.readline(), 5.0)).decode(errors="replace").split()
+            # The headers, the body of a GET request is empty
+            while (await asyncio.wait_for(reader.readline(), 5.0)).strip():
+                pass
+            page = (pages or {}).get(request[1] if len(request) > 1 else None)
+            body = (page() if page is not None else registry.render()).encode()
+            writer.write(f"HTTP/1.0 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    kind, location = parse_address(address)
+    if kind == "unix":
+        return await asyncio.start_unix_server(handle, path=location)
+    return await asyncio.start_server(handle, host=location[0], port=location[1])
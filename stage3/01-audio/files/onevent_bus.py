@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Socket transports for librespot events, as alternatives to the named pipe.
+#
+# A local publish/subscribe bus: every subscriber binds a Unix datagram socket in the bus directory,
+# and the hooks send each event to every socket found there. The kernel bounds the queue of each
+# subscriber (net.unix.max_dgram_qlen datagrams), an event that does not fit is dropped for that
+# subscriber only, so a stalled subscriber never delays the others.
+#
+# A point-to-point Unix socket the plugin listens on, either SOCK_SEQPACKET (one connection per
+# event) or SOCK_DGRAM. Unlike the pipe, each event arrives as one message, so there is no line
+# framing and no end-of-file to deal with. Only an event larger than the send buffer of the socket
+# is split into fragments, by onevent_fifo.py, which are sent in order as several messages.
+
+import os
+import sys
+import time
+import select
+import socket
+
+BUS_PATH = "/tmp/spotbus"
+
+SOCKET_SUFFIX = ".sock"
+
+# Endpoints are either a plain path to a named pipe, or a path prefixed with its transport, e.g. "bus:/tmp/spotbus"
+ENDPOINT_SCHEMES = ("fifo", "bus", "seqpacket", "dgram")
+
+SOCKET_TYPES = {"seqpacket": socket.SOCK_SEQPACKET, "dgram": socket.SOCK_DGRAM}
+
+# Pending connections of hooks not accepted yet by the plugin
+LISTEN_BACKLOG = 64
+
+# Larger than any librespot event, a whole event always fits in one datagram
+MAX_EVENT_SIZE = 1 << 20
+
+VERSION = "1.0"
+
+def parse_endpoint(endpoint):
+    """
+    Splits an event endpoint into its transport and its path.
+
+    Args:
+        endpoint (str): The endpoint, e.g. "/tmp/spotfifo", "bus:/tmp/spotbus" or "seqpacket:/tmp/spotfifo.sock".
+
+    Returns:
+        tuple: The transport ("fifo", "bus", "seqpacket" or "dgram") and the file system path of the endpoint.
+    """
+    scheme, sep, path = endpoint.partition(":")
+    if sep and scheme in ENDPOINT_SCHEMES:
+        return scheme, path
+    return "fifo", endpoint
+
+def drain(sock):
+    """
+    Receives every message queued on a non-blocking socket.
+
+    Args:
+        sock (socket.socket): The socket.
+
+    Returns:
+        list: The messages, as bytes, oldest first. An empty message means the peer closed a connected socket.
+    """
+    messages = []
+    while True:
+        try:
+            message = sock.recv(MAX_EVENT_SIZE)
+        except BlockingIOError:
+            return messages
+        messages.append(message)
+        if not message and sock.type == socket.SOCK_SEQPACKET:
+            return messages
+
+def bind(sock, path):
+    """
+    Binds a socket to a path, replacing the socket file left over by a previous instance.
+
+    Args:
+        sock (socket.socket): The socket.
+        path (str): The file system path to bind to.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock.bind(path)
+    # The hooks may run as a different user
+    os.chmod(path, 0o666)
+    sock.setblocking(False)
+
+def send_messages(kind, path, payloads, deadline):
+    """
+    Sends messages in order to the Unix socket the plugin listens on, over a single connection.
+
+    Args:
+        kind (str): The type of the socket, "seqpacket" or "dgram".
+        path (str): The file system path to the socket.
+        payloads (list): The messages, as bytes: a serialized event, or its fragments.
+        deadline (float): The time.monotonic() value after which to give up waiting for the plugin.
+
+    Returns:
+        int: The number of messages the plugin received, the first ones.
+
+    Raises:
+        OSError: EMSGSIZE if a message is larger than the send buffer of the socket, nothing was sent from it on.
+    """
+    delay = 0.005
+    sent = 0
+    with socket.socket(socket.AF_UNIX, SOCKET_TYPES[kind]) as sock:
+        sock.setblocking(False)
+        connected = False
+        while True:
+            try:
+                if not connected:
+                    sock.connect(path)
+                    connected = True
+                while sent < len(payloads):
+                    sock.send(payloads[sent])
+                    sent += 1
+                return sent
+            except BlockingIOError:
+                # The queue of the plugin (or its backlog of connections) is full
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The plugin is not listening yet
+                connected = False
+            except (BrokenPipeError, ConnectionResetError):
+                return sent
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return sent
+            time.sleep(min(delay, remaining))
+            delay *= 2
+
+def publish(path, payload):
+    """
+    Sends an event to every subscriber of a bus, without blocking.
+
+    Sockets left over by subscribers that exited without unsubscribing are removed.
+
+    Args:
+        path (str): The file system path to the bus directory.
+        payload (bytes): The serialized event.
+
+    Returns:
+        tuple: The lists of the names of the subscribers the event was delivered to, and of those whose queue was full.
+    """
+    delivered, overflowed = [], []
+    try:
+        names = [name[:-len(SOCKET_SUFFIX)] for name in os.listdir(path) if name.endswith(SOCKET_SUFFIX)]
+    except FileNotFoundError:
+        return delivered, overflowed
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for name in names:
+            address = os.path.join(path, name + SOCKET_SUFFIX)
+            try:
+                sock.sendto(payload, address)
+                delivered.append(name)
+            except BlockingIOError:
+                overflowed.append(name)
+            except ConnectionRefusedError:
+                try:
+                    os.unlink(address)
+                except OSError:
+                    pass
+            except FileNotFoundError:
+                pass
+    return delivered, overflowed
+
+class Subscriber(object):
+
+    def __init__(self, name, path=BUS_PATH):
+        """
+        Subscribes to a bus, creating it if needed.
+
+        Args:
+            name (str): The name of the subscriber, unique on the bus, e.g. "snapcast" or "scrobbler".
+            path (str): The file system path to the bus directory.
+        """
+        try:
+            os.mkdir(path)
+            # The hooks and the subscribers may run as different users
+            os.chmod(path, 0o1777)
+        except FileExistsError:
+            pass
+
+        self._path = os.path.join(path, name + SOCKET_SUFFIX)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            bind(self._sock, self._path)
+        except:
+            self._sock.close()
+            raise
+
+    def fileno(self):
+        """
+        Returns the file descriptor of the subscriber socket, so that it can be passed to select().
+        """
+        return self._sock.fileno()
+
+    def recv(self):
+        """
+        Receives every event queued for the subscriber, without blocking.
+
+        Returns:
+            list: The serialized events, as bytes, oldest first.
+        """
+        return drain(self._sock)
+
+    def close(self):
+        """
+        Unsubscribes from the bus.
+        """
+        self._sock.close()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+class Listener(object):
+
+    def __init__(self, kind, path):
+        """
+        Listens for events on a Unix socket.
+
+        With SOCK_SEQPACKET, every hook connects, sends its event and disconnects. The listening socket
+        and the accepted connections are watched by an epoll instance, whose own file descriptor is the
+        one to pass to select(), so the caller only ever sees a single readable file.
+
+        Args:
+            kind (str): The type of the socket, "seqpacket" or "dgram".
+            path (str): The file system path to bind the socket to.
+        """
+        self._path = path
+        self._sock = socket.socket(socket.AF_UNIX, SOCKET_TYPES[kind])
+        self._poll = None
+        self._connections = {}
+        try:
+            bind(self._sock, path)
+            if kind == "seqpacket":
+                self._sock.listen(LISTEN_BACKLOG)
+                self._poll = select.epoll()
+                self._poll.register(self._sock, select.EPOLLIN)
+        except:
+            self._sock.close()
+            raise
+
+    def fileno(self):
+        """
+        Returns the file descriptor to pass to select(), readable whenever events are pending.
+        """
+        return self._poll.fileno() if self._poll is not None else self._sock.fileno()
+
+    def _accept(self):
+        """
+        Accepts every pending connection.
+        """
+        while True:
+            try:
+                connection, _ = self._sock.accept()
+            except BlockingIOError:
+                return
+            connection.setblocking(False)
+            self._connections[connection.fileno()] = connection
+            self._poll.register(connection, select.EPOLLIN)
+
+    def _disconnect(self, connection):
+        """
+        Forgets a connection closed by its hook.
+        """
+        self._poll.unregister(connection)
+        del self._connections[connection.fileno()]
+        connection.close()
+
+    def recv(self):
+        """
+        Receives every event ready on the socket, without blocking.
+
+        Returns:
+            list: The serialized events, as bytes.
+        """
+        if self._poll is None:
+            return drain(self._sock)
+
+        messages = []
+        for fd, _ in self._poll.poll(0):
+            if fd == self._sock.fileno():
+                self._accept()
+                continue
+            connection = self._connections[fd]
+            try:
+                received = drain(connection)
+            except OSError:
+                received = [b""]
+            messages.extend(message for message in received if message)
+            if received and not received[-1]:
+                self._disconnect(connection)
+        return messages
+
+    def close(self):
+        """
+        Stops listening.
+        """
+        for connection in list(self._connections.values()):
+            self._disconnect(connection)
+        if self._poll is not None:
+            self._poll.close()
+        self._sock.close()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), description="Print the librespot events published on a bus, one JSON object per line.")
+
+    parser.add_argument('name', help='Set the name to subscribe with')
+    parser.add_argument('-b', '--bus', default=BUS_PATH, help='Set the bus directory to subscribe to (default: %(default)s)')
+    parser.add_argument('-v', '--version', action='version', version=VERSION)
+
+    args = parser.parse_args()
+
+    subscriber = Subscriber(args.name, args.bus)
+    try:
+        while True:
+            select.select([subscriber], [], [])
+            for message in subscriber.recv():
+                print(message.decode(), flush=True)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        subscriber.close()
@@ -4,20 +4,318 @@
 import os
 import sys
 import json
-from pathlib import Path
+import time
+import errno
+import fcntl
+import select
 
-FIFO_PATH = "/tmp/spotfifo"
+import onevent_journal
+
+def instance_path(path, instance):
+    """
+    Derives the path of an endpoint for an instance of the templated raspotify@ service.
+
+    The default instance keeps the path unchanged, other instances get their name appended to its
+    stem, e.g. "/tmp/spotfifo" becomes "/tmp/spotfifo-kitchen" for the "kitchen" instance.
+
+    Args:
+        path (str): The path of the endpoint for the default instance.
+        instance (str): The name of the instance.
+
+    Returns:
+        str: The path of the endpoint for the instance.
+    """
+    if not instance or instance == "default":
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{instance}{ext}"
+
+# The instance of librespot running this hook, each instance talks to its own snapserver plugin
+INSTANCE = os.environ.get("ONEVENT_INSTANCE", "default")
+
+# The endpoint the plugin reads events from: a named pipe, a bus directory when prefixed with "bus:",
+# or a Unix socket when prefixed with "seqpacket:" or "dgram:"
+FIFO_PATH = os.environ.get("ONEVENT_FIFO", instance_path("/tmp/spotfifo", INSTANCE))
+
+# The journal every event is appended to, so that the plugin can rebuild its state when it (re)starts
+JOURNAL_PATH = os.environ.get("ONEVENT_JOURNAL", instance_path(onevent_journal.JOURNAL_PATH, INSTANCE))
+
+# How long to wait for the plugin to open the pipe and accept the event, in seconds
+SEND_TIMEOUT = float(os.environ.get("ONEVENT_TIMEOUT", "0.5"))
+
+# What to do with an event nobody reads before the deadline: "spool" it for the plugin to replay on startup, or "drop" it
+SEND_POLICY = os.environ.get("ONEVENT_POLICY", "spool")
+
+# CLOCK_MONOTONIC time at which librespot emitted the event being sent, in nanoseconds
+emit_time = None
+
+# When set, every hook environment is also appended to this JSONL trace, see bench/onevent_replay.py
+CAPTURE_PATH = os.environ.get("ONEVENT_CAPTURE")
+
+# The variables librespot sets for player events
+EVENT_VARIABLES = (
+    "PLAYER_EVENT", "VOLUME", "TRACK_ID", "POSITION_MS", "ITEM_TYPE", "URI", "NAME", "DURATION_MS",
+    "IS_EXPLICIT", "LANGUAGE", "COVERS", "NUMBER", "DISC_NUMBER", "POPULARITY", "ALBUM", "ARTISTS",
+    "ALBUM_ARTISTS", "SHOW_NAME", "PUBLISH_TIME", "DESCRIPTION", "SHUFFLE", "REPEAT", "REPEAT_TRACK", "AUTO_PLAY",
+    "FILTER", "SINK_STATUS", "USER_NAME", "CONNECTION_ID", "CLIENT_ID", "CLIENT_NAME", "CLIENT_BRAND_NAME", "CLIENT_MODEL_NAME"
+)
+
+# Writes to a pipe up to this size are atomic, larger events are split into fragments that fit in it
+FRAGMENT_PREFIX = "~"
+FRAGMENT_SIZE = select.PIPE_BUF - 64
+
+# Messages to a Unix socket cannot exceed its send buffer (net.core.wmem_default), larger events are split into fragments of this size
+SOCKET_FRAGMENT_SIZE = 64 * 1024
+
+def frame(payload, size=FRAGMENT_SIZE):
+    """
+    Frames a serialized event into lines that can each be written to a pipe atomically.
+
+    Events up to PIPE_BUF bytes are sent as a single JSON line, as they always were. Larger events
+    would interleave with the events other hooks write concurrently, so they are split into
+    fragment lines of the form "~<id> <index> <count> <data>", which the plugin reassembles.
+
+    Args:
+        payload (str): The JSON-serialized event, which contains no newline.
+        size (int): The maximum size of the data of a fragment, in bytes.
+
+    Returns:
+        list: The lines to be written, as bytes.
+    """
+    data = payload.encode()
+    if len(data) < select.PIPE_BUF:
+        return [data + b"\n"]
+
+    id = f"{os.getpid()}.{time.monotonic_ns()}"
+    fragments = [data[i:i + size] for i in range(0, len(data), size)]
+    return [f"{FRAGMENT_PREFIX}{id} {index} {len(fragments)} ".encode() + fragment + b"\n" for index, fragment in enumerate(fragments)]
+
+def open_fifo(path, deadline):
+    """
+    Opens a named pipe for writing without blocking when it has no reader.
+
+    Args:
+        path (str): The file system path to the named pipe.
+        deadline (float): The time.monotonic() value after which to give up waiting for a reader.
+
+    Returns:
+        int: A non-blocking file descriptor for the pipe, or None if no reader opened it before the deadline.
+    """
+    delay = 0.005
+    while True:
+        try:
+            return os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            # ENXIO: nobody has the pipe open for reading, ENOENT: the plugin has not created it yet
+            if e.errno not in (errno.ENXIO, errno.ENOENT):
+                raise
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay *= 2
+
+def write_fifo(fd, data, deadline):
+    """
+    Writes data to a non-blocking pipe, waiting for room until the deadline.
+
+    Args:
+        fd (int): The file descriptor of the pipe.
+        data (bytes): The data to be written.
+        deadline (float): The time.monotonic() value after which to give up writing.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    written = 0
+    while written < len(data):
+        try:
+            written += os.write(fd, data[written:])
+            continue
+        except BlockingIOError:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        select.select([], [fd], [], remaining)
+    return written
+
+def parse_endpoint(endpoint):
+    """
+    Splits an event endpoint into its transport and its path, see onevent_bus.parse_endpoint().
+
+    onevent_bus is only imported for the socket transports: importing socket costs every hook run
+    several milliseconds of CPU time, and the named pipe does not need it.
+
+    Args:
+        endpoint (str): The endpoint, e.g. "/tmp/spotfifo" or "bus:/tmp/spotbus".
+
+    Returns:
+        tuple: The transport ("fifo", "bus", "seqpacket" or "dgram") and the file system path of the endpoint.
+    """
+    if ":" not in endpoint:
+        return "fifo", endpoint
+    import onevent_bus
+    return onevent_bus.parse_endpoint(endpoint)
+
+def count(counter):
+    """
+    Increments one of the undelivered event counters shared by all hook processes.
+
+    The counters are stored as JSON next to the endpoint (e.g. /tmp/spotfifo.stats) so that they
+    survive the short-lived hook processes and can be read by the plugin.
+
+    Args:
+        counter (str): The name of the counter, "dropped", "spooled", "oversized" or "overflowed:<subscriber>".
+    """
+    fd = os.open(parse_endpoint(FIFO_PATH)[1] + ".stats", os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            stats = json.loads(os.read(fd, 4096) or b"{}")
+        except ValueError:
+            stats = {}
+        stats[counter] = stats.get(counter, 0) + 1
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps(stats).encode())
+    finally:
+        os.close(fd)
+
+def open_journal():
+    """
+    Opens the journal shared with the other hooks and the plugin.
+
+    Returns:
+        onevent_journal.Journal: The journal, or None if it cannot be opened.
+    """
+    try:
+        return onevent_journal.Journal(JOURNAL_PATH)
+    except OSError:
+        return None
+
+def write_event(path, payload, deadline):
+    """
+    Writes a serialized event to a named pipe.
+
+    Args:
+        path (str): The file system path to the named pipe.
+        payload (str): The JSON-serialized event.
+        deadline (float): The time.monotonic() value after which to give up writing.
+
+    Returns:
+        tuple: The number of lines written and the number of lines the event was framed into.
+    """
+    lines = frame(payload)
+    written = 0
+    fd = open_fifo(path, deadline)
+    if fd is not None:
+        try:
+            while written < len(lines) and write_fifo(fd, lines[written], deadline) == len(lines[written]):
+                written += 1
+        finally:
+            os.close(fd)
+    return written, len(lines)
+
+def publish_event(path, payload):
+    """
+    Publishes a serialized event to every subscriber of a bus, as a single datagram.
+
+    Subscribers whose queue is full miss the event, which is counted for each of them. An event
+    larger than a datagram can be is counted as oversized, and not delivered to any subscriber.
+
+    Args:
+        path (str): The file system path to the bus directory.
+        payload (str): The JSON-serialized event.
+
+    Returns:
+        tuple: The number of datagrams delivered and sent, as for write_event(): (1, 1) if at least one subscriber received the event.
+    """
+    import onevent_bus
+    try:
+        delivered, overflowed = onevent_bus.publish(path, payload.encode())
+    except OSError as e:
+        if e.errno != errno.EMSGSIZE:
+            raise
+        # The subscribers expect whole events, one per datagram, the event cannot be fragmented for them
+        count("oversized")
+        return 0, 1
+    for name in overflowed:
+        count(f"overflowed:{name}")
+    return (1 if delivered else 0), 1
+
+def send_message(kind, path, payload, deadline):
+    """
+    Sends a serialized event to the Unix socket the plugin listens on, as a single message.
+
+    An event larger than the send buffer of the socket is split into fragments instead, as for
+    the named pipe, which are sent as several messages.
+
+    Args:
+        kind (str): The type of the socket, "seqpacket" or "dgram".
+        path (str): The file system path to the socket.
+        payload (str): The JSON-serialized event.
+        deadline (float): The time.monotonic() value after which to give up waiting for the plugin.
+
+    Returns:
+        tuple: The number of messages received by the plugin and the number of messages the event was split into, as for write_event().
+    """
+    import onevent_bus
+    try:
+        return onevent_bus.send_messages(kind, path, [payload.encode()], deadline), 1
+    except OSError as e:
+        if e.errno != errno.EMSGSIZE:
+            raise
+    fragments = frame(payload, SOCKET_FRAGMENT_SIZE)
+    try:
+        return onevent_bus.send_messages(kind, path, fragments, deadline), len(fragments)
+    except OSError as e:
+        if e.errno != errno.EMSGSIZE:
+            raise
+        # The send buffer is smaller than a fragment
+        return 0, len(fragments)
 
 def send(event):
     """
-    Sends an event by serializing it to JSON and writing it to a named pipe.
+    Sends an event by serializing it to JSON and writing it to the endpoint, a named pipe, a bus or a Unix socket.
+
+    The event is stamped with its emission time, then appended to the journal, and the sequence
+    number it gets is added to the event. The pipe is opened without blocking. If the plugin does not read it before SEND_TIMEOUT
+    expires, or if no subscriber of the bus receives it, the event is left in the journal for the plugin to replay on
+    startup ("spool") or discarded from it ("drop") according to SEND_POLICY, and counted.
 
     Args:
         event (dict): The event data to be sent.
     """
-    with open(FIFO_PATH, "w") as fifo:
-        fifo.write(json.dumps(event) + "\n")
-        fifo.flush()
+    event["ts"] = emit_time if emit_time is not None else time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+    payload = json.dumps(event)
+    journal = open_journal()
+    try:
+        record = journal.append(payload.encode()) if journal is not None else None
+        if record is not None:
+            payload = f'{{"seq": {record[0]}, {payload[1:]}'
+
+        scheme, path = parse_endpoint(FIFO_PATH)
+        if scheme == "bus":
+            written, total = publish_event(path, payload)
+        elif scheme != "fifo":
+            written, total = send_message(scheme, path, payload, time.monotonic() + SEND_TIMEOUT)
+        else:
+            written, total = write_event(path, payload, time.monotonic() + SEND_TIMEOUT)
+
+        if written == total:
+            return
+
+        # A partially written event cannot be replayed: the plugin already received its beginning
+        if written == 0 and SEND_POLICY == "spool" and record is not None:
+            count("spooled")
+        else:
+            if record is not None:
+                journal.discard(*record)
+            count("dropped")
+    finally:
+        if journal is not None:
+            journal.close()
 
 def send_volume(volume):
     """
@@ -130,56 +428,188 @@ def send_episode_changed_event(track_id, uri, name, duration_ms, is_explicit, la
     }
     send(event)
 
-if __name__ == "__main__":
-    player_event = os.environ.get("PLAYER_EVENT")
+def send_setting_event(event_type, **settings):
+    """
+    Sends a playback setting event with the specified type and values.
+
+    Args:
+        event_type (str): The type of player event ("shuffle_changed", "repeat_changed", "auto_play_changed" or "filter_explicit_content_changed").
+        **settings (bool): The new values of the settings, e.g. shuffle=True.
+    """
+    event = {
+        "event": event_type,
+        **settings
+    }
+    send(event)
+
+def send_session_event(event_type, user_name, connection_id):
+    """
+    Sends a session event with the specified type, user name, and connection ID.
+
+    Args:
+        event_type (str): The type of player event ("session_connected" or "session_disconnected").
+        user_name (str): The name of the Spotify user.
+        connection_id (str): The ID of the Spotify Connect session.
+    """
+    event = {
+        "event": event_type,
+        "user_name": user_name,
+        "connection_id": connection_id
+    }
+    send(event)
+
+def send_session_client_changed_event(client_id, client_name, client_brand_name, client_model_name):
+    """
+    Sends a session client changed event with the specified details of the controlling device.
+
+    Args:
+        client_id (str): The ID of the Spotify Connect client.
+        client_name (str): The name of the client.
+        client_brand_name (str): The brand of the client device.
+        client_model_name (str): The model of the client device.
+    """
+    event = {
+        "event": "session_client_changed",
+        "client_id": client_id,
+        "client_name": client_name,
+        "client_brand_name": client_brand_name,
+        "client_model_name": client_model_name
+    }
+    send(event)
+
+def send_sink_event(sink_status):
+    """
+    Sends an audio sink event.
+
+    Args:
+        sink_status (str): The status of the sink ("running", "temporarily_closed" or "closed").
+    """
+    event = {
+        "event": "sink",
+        "sink_status": sink_status
+    }
+    send(event)
+
+def capture(environ):
+    """
+    Appends a hook environment to the capture trace, as a single JSON line.
+
+    Args:
+        environ (Mapping): The environment librespot passed to the hook.
+    """
+    record = {"ts": emit_time, "env": {key: environ[key] for key in EVENT_VARIABLES if key in environ}}
+    fd = os.open(CAPTURE_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode())
+    finally:
+        os.close(fd)
+
+def dispatch(environ):
+    """
+    Sends the event described by a librespot hook environment.
+
+    Args:
+        environ (Mapping): The environment librespot passed to the hook, holding PLAYER_EVENT and its variables.
+
+    Returns:
+        bool: False if the environment does not describe a player event, True otherwise.
+    """
+    global emit_time
+
+    player_event = environ.get("PLAYER_EVENT")
     if not player_event:
-        sys.exit(1)
+        return False
+
+    # onevent_forwarder.py stamps the events of onevent_hook.sh as soon as it reads them
+    emit_time = int(environ["ONEVENT_TS"]) if "ONEVENT_TS" in environ else time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+
+    if CAPTURE_PATH:
+        capture(environ)
 
     if player_event == "volume_changed":
-        send_volume(int(os.environ.get("VOLUME")))
+        send_volume(int(environ.get("VOLUME")))
 
     elif player_event in ["playing", "paused", "seeked", "position_correction"]:
         send_track_position_event(
             player_event,
-            os.environ.get("TRACK_ID"),
-            int(os.environ.get("POSITION_MS"))
+            environ.get("TRACK_ID"),
+            int(environ.get("POSITION_MS"))
         )
 
     elif player_event in ["unavailable", "end_of_track", "preload_next", "preloading", "loading", "stopped"]:
         send_track_id_event(
             player_event,
-            os.environ.get("TRACK_ID")
+            environ.get("TRACK_ID")
         )
 
     elif player_event == "track_changed":
-        item_type = os.environ.get("ITEM_TYPE")
+        item_type = environ.get("ITEM_TYPE")
         if item_type == "Track":
             send_track_changed_event(
-                os.environ.get("TRACK_ID"),
-                os.environ.get("URI"),
-                os.environ.get("NAME"),
-                int(os.environ.get("DURATION_MS")),
-                bool(os.environ.get("IS_EXPLICIT")),
-                os.environ.get("LANGUAGE").split("\n"),
-                os.environ.get("COVERS").split("\n"),
-                int(os.environ.get("NUMBER")),
-                int(os.environ.get("DISC_NUMBER")),
-                os.environ.get("POPULARITY"),
-                os.environ.get("ALBUM"),
-                os.environ.get("ARTISTS").split("\n"),
-                os.environ.get("ALBUM_ARTISTS").split("\n")
+                environ.get("TRACK_ID"),
+                environ.get("URI"),
+                environ.get("NAME"),
+                int(environ.get("DURATION_MS")),
+                bool(environ.get("IS_EXPLICIT")),
+                environ.get("LANGUAGE").split("\n"),
+                environ.get("COVERS").split("\n"),
+                int(environ.get("NUMBER")),
+                int(environ.get("DISC_NUMBER")),
+                environ.get("POPULARITY"),
+                environ.get("ALBUM"),
+                environ.get("ARTISTS").split("\n"),
+                environ.get("ALBUM_ARTISTS").split("\n")
             )
         elif item_type == "Episode":
             send_episode_changed_event(
-                os.environ.get("TRACK_ID"),
-                os.environ.get("URI"),
-                os.environ.get("NAME"),
-                int(os.environ.get("DURATION_MS")),
-                bool(os.environ.get("IS_EXPLICIT")),
-                os.environ.get("LANGUAGE").split("\n"),
-                os.environ.get("COVERS").split("\n"),
-                os.environ.get("SHOW_NAME"),
-                os.environ.get("PUBLISH_TIME"),
-                os.environ.get("DESCRIPTION")
+                environ.get("TRACK_ID"),
+                environ.get("URI"),
+                environ.get("NAME"),
+                int(environ.get("DURATION_MS")),
+                bool(environ.get("IS_EXPLICIT")),
+                environ.get("LANGUAGE").split("\n"),
+                environ.get("COVERS").split("\n"),
+                environ.get("SHOW_NAME"),
+                environ.get("PUBLISH_TIME"),
+                environ.get("DESCRIPTION")
             )
 
+    elif player_event == "shuffle_changed":
+        send_setting_event(player_event, shuffle=environ.get("SHUFFLE") == "true")
+
+    elif player_event == "repeat_changed":
+        send_setting_event(
+            player_event,
+            repeat=environ.get("REPEAT") == "true",
+            repeat_track=environ.get("REPEAT_TRACK") == "true"
+        )
+
+    elif player_event in ["auto_play_changed", "autoplay_changed"]:
+        send_setting_event("auto_play_changed", auto_play=environ.get("AUTO_PLAY") == "true")
+
+    elif player_event == "filter_explicit_content_changed":
+        send_setting_event(player_event, filter=environ.get("FILTER") == "true")
+
+    elif player_event in ["session_connected", "session_disconnected"]:
+        send_session_event(
+            player_event,
+            environ.get("USER_NAME"),
+            environ.get("CONNECTION_ID")
+        )
+
+    elif player_event == "session_client_changed":
+        send_session_client_changed_event(
+            environ.get("CLIENT_ID"),
+            environ.get("CLIENT_NAME"),
+            environ.get("CLIENT_BRAND_NAME"),
+            environ.get("CLIENT_MODEL_NAME")
+        )
+
+    elif player_event == "sink":
+        send_sink_event(environ.get("SINK_STATUS"))
+
+    return True
+
+if __name__ == "__main__":
+    if not dispatch(os.environ):
+        sys.exit(1)
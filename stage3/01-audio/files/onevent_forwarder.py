@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+import onevent_fifo
+
+# The named pipe onevent_hook.sh writes to, in the runtime directory of onevent-forwarder@<instance>.service
+FORWARDER_PATH = "/run/onevent-forwarder/{instance}/events"
+
+VERSION = "1.0"
+
+params = {
+    'instance': onevent_fifo.INSTANCE,
+    'hook_fifo': None,
+    'librespot_fifo': None,
+    'librespot_journal': None
+}
+
+def parse(message):
+    """
+    Parses a record written by onevent_hook.sh into a hook environment.
+
+    Args:
+        message (bytes): The NUL-terminated KEY=VALUE items of the event.
+
+    Returns:
+        dict: The event variables.
+    """
+    environ = {}
+    for item in message.decode().split("\0"):
+        key, sep, value = item.partition("=")
+        if sep:
+            environ[key] = value
+    return environ
+
+class Forwarder(object):
+
+    def __init__(self, path, max_record=1 << 20):
+        """
+        Initializes the forwarder.
+
+        Args:
+            path (str): The file system path of the named pipe to read hook records from.
+            max_record (int): The maximum size of an incomplete record, it is discarded beyond it.
+        """
+        self._path = path
+        self._max_record = max_record
+        self._fd = None
+
+    def _open(self):
+        """
+        Creates and opens the named pipe, replacing the one left over by a previous instance.
+
+        The pipe is opened for writing too, so that reading it blocks between hooks rather than returning end of file.
+        """
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+        os.mkfifo(self._path)
+        # librespot may run the hook as a different user
+        os.chmod(self._path, 0o622)
+        self._fd = os.open(self._path, os.O_RDWR)
+
+    def _forward(self, record, ts):
+        """
+        Sends the event of a hook record to the snapserver plugin.
+
+        Args:
+            record (bytes): The record, without its terminating empty item.
+            ts (int): The CLOCK_MONOTONIC time at which the record was read, in nanoseconds.
+        """
+        try:
+            environ = parse(record)
+            # The hook cannot read CLOCK_MONOTONIC, the pipe keeps the records in the order the hooks wrote them
+            environ["ONEVENT_TS"] = str(ts)
+            if not onevent_fifo.dispatch(environ):
+                logger.debug(f"Not a player event: {environ}")
+        except Exception as e:
+            logger.warning(f"Failed to forward event {record[:64]}: {e}")
+
+    def run(self):
+        """
+        Reads hook records and forwards each event to the snapserver plugin until interrupted.
+        """
+        try:
+            self._open()
+        except OSError as e:
+            logger.error(f"Failed to create {self._path}: {e}")
+            sys.exit(1)
+
+        logger.debug(f'Reading {self._path}')
+        buffer = b""
+        try:
+            while True:
+                buffer += os.read(self._fd, 65536)
+                ts = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+                # Every item ends with a NUL and none is empty, so two NULs in a row end a record
+                *records, buffer = buffer.split(b"\0\0")
+                for record in records:
+                    self._forward(record, ts)
+                if len(buffer) > self._max_record:
+                    logger.warning(f"Discarding {len(buffer)} bytes without a record end")
+                    buffer = b""
+        except KeyboardInterrupt:
+            pass
+        finally:
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+            os.close(self._fd)
+            logger.debug('Exiting.')
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]))
+
+    parser.add_argument('-i', '--instance', default=params['instance'], help='Set the librespot instance to forward events for (default: %(default)s)')
+    parser.add_argument('-f', '--hook-fifo', default=params['hook_fifo'], help='Set the named pipe to read hook events from (default: derived from the instance)')
+    parser.add_argument('--librespot-fifo', default=params['librespot_fifo'], help='Set the fifo to forward events to (default: ONEVENT_FIFO, or derived from the instance)')
+    parser.add_argument('--librespot-journal', default=params['librespot_journal'], help='Set the journal to record events in (default: ONEVENT_JOURNAL, or derived from the instance)')
+    parser.add_argument('-d', '--debug', action='store_true', help='Run in debug mode')
+    parser.add_argument('-v', '--version', action='version', version=VERSION)
+
+    args = parser.parse_args()
+
+    params['instance'] = args.instance
+    params['hook_fifo'] = args.hook_fifo or FORWARDER_PATH.format(instance=args.instance or "default")
+    # The endpoints set in the raspotify configuration of the instance, as seen by the hooks, take precedence
+    params['librespot_fifo'] = args.librespot_fifo or os.environ.get("ONEVENT_FIFO") or onevent_fifo.instance_path("/tmp/spotfifo", args.instance)
+    params['librespot_journal'] = args.librespot_journal or os.environ.get("ONEVENT_JOURNAL") or onevent_fifo.instance_path(onevent_fifo.onevent_journal.JOURNAL_PATH, args.instance)
+    onevent_fifo.FIFO_PATH = params['librespot_fifo']
+    onevent_fifo.JOURNAL_PATH = params['librespot_journal']
+
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('%(asctime)s %(module)s %(levelname)s: %(message)s'))
+
+    logger = logging.getLogger('onevent_forwarder')
+    logger.propagate = False
+    logger.setLevel(logging.INFO if not args.debug else logging.DEBUG)
+    logger.addHandler(log_handler)
+
+    forwarder = Forwarder(params['hook_fifo'])
+    forwarder.run()
@@ -0,0 +1,39 @@
+#!/bin/sh
+
+# librespot runs this hook for every player event. It only writes the event variables to the named
+# pipe of onevent_forwarder.py and exits, without running any other program, so that an event costs
+# a shell start rather than a Python one. When no forwarder is running, or when the event is too
+# large to be written to the pipe atomically, it handles the event with onevent_fifo.py instead.
+
+[ -n "$PLAYER_EVENT" ] || exit 1
+
+# The pipe lives in the runtime directory of onevent-forwarder@<instance>.service, which the
+# PrivateTmp=true of raspotify@<instance>.service does not hide
+FORWARDER="${ONEVENT_FORWARDER:-/run/onevent-forwarder/${ONEVENT_INSTANCE:-default}/events}"
+
+# Writes to a pipe up to this size are atomic, the events of concurrent hooks do not interleave
+PIPE_BUF=4096
+
+# Measure the event in bytes, not in characters
+LC_ALL=C
+
+# The event is a record of NUL-terminated KEY=VALUE items, terminated by an empty item
+set --
+size=1
+for key in PLAYER_EVENT VOLUME TRACK_ID POSITION_MS ITEM_TYPE URI NAME DURATION_MS IS_EXPLICIT LANGUAGE \
+           COVERS NUMBER DISC_NUMBER POPULARITY ALBUM ARTISTS ALBUM_ARTISTS SHOW_NAME PUBLISH_TIME DESCRIPTION \
+           SHUFFLE REPEAT REPEAT_TRACK AUTO_PLAY FILTER SINK_STATUS USER_NAME CONNECTION_ID CLIENT_ID CLIENT_NAME \
+           CLIENT_BRAND_NAME CLIENT_MODEL_NAME; do
+    eval "item=\${$key+$key=\$$key}"
+    if [ -n "$item" ]; then
+        set -- "$@" "$item"
+        size=$((size + ${#item} + 1))
+    fi
+done
+
+# The pipe is opened for reading too, so that the hook never blocks waiting for a reader
+if [ -p "$FORWARDER" ] && [ "$size" -le "$PIPE_BUF" ] && printf '%s\0' "$@" "" 1<>"$FORWARDER"; then
+    exit 0
+fi
+
+exec /usr/bin/python3 -S "${0%/*}/onevent_fifo.py"
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import zlib
+import time
+import fcntl
+import struct
+
+JOURNAL_PATH = "/dev/shm/spotfifo.journal"
+
+# Size of the record area, the oldest records are overwritten once it is full
+JOURNAL_SIZE = 64 * 1024
+
+MAGIC = b"OEJ1"
+
+# magic, capacity, tail, head, next sequence number, acknowledged sequence number, crc32 of the previous fields
+HEADER = struct.Struct("<4sIQQQQI")
+
+# payload length, flags, crc32 of the payload, sequence number
+RECORD = struct.Struct("<IIIQ")
+
+# The event was not delivered and must not be replayed
+FLAG_DISCARDED = 0x1
+
+class Journal(object):
+    """
+    A bounded ring of librespot events shared by the hooks and the snapserver plugin.
+
+    The journal is a fixed-size, memory-mapped file. Each hook appends its event under an exclusive
+    lock and gets a sequence number back. The plugin acknowledges the sequence numbers it processed
+    and replays the retained events when it starts. Tail and head are absolute byte offsets into
+    the ring, and the header is only updated once a record is completely written and carries a
+    checksum, so a process dying mid-write never leaves a half record visible.
+    """
+
+    def __init__(self, path=JOURNAL_PATH, size=JOURNAL_SIZE):
+        """
+        Opens the journal, creating or resetting it if it is missing or corrupted.
+
+        Args:
+            path (str): The file system path to the journal, preferably on a tmpfs.
+            size (int): The size of the record area in bytes, used when the journal is created.
+        """
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size < HEADER.size:
+                    # The hooks and the plugin may run as different users
+                    os.fchmod(self._fd, 0o666)
+                    os.ftruncate(self._fd, HEADER.size + size)
+                self._mm = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+                if self._read_header() is None:
+                    self._reset(size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        except:
+            os.close(self._fd)
+            raise
+
+    def close(self):
+        """
+        Unmaps and closes the journal.
+        """
+        self._mm.close()
+        os.close(self._fd)
+
+    def _reset(self, size):
+        """
+        Reinitializes an empty journal.
+
+        Sequence numbers restart from the monotonic clock in microseconds, so that they keep
+        increasing for a plugin that outlives the reset.
+
+        Args:
+            size (int): The size of the record area in bytes.
+        """
+        self._mm.close()
+        os.ftruncate(self._fd, HEADER.size + size)
+        self._mm = mmap.mmap(self._fd, HEADER.size + size)
+        self._write_header(size, 0, 0, time.monotonic_ns() // 1000, 0)
+
+    def _read_header(self):
+        """
+        Reads and validates the journal header.
+
+        Returns:
+            tuple: (capacity, tail, head, next_seq, acked), or None if the header is invalid.
+        """
+        magic, capacity, tail, head, next_seq, acked, crc = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or crc != zlib.crc32(self._mm[:HEADER.size - 4]):
+            return None
+        if capacity != len(self._mm) - HEADER.size or not tail <= head <= tail + capacity:
+            return None
+        return capacity, tail, head, next_seq, acked
+
+    def _write_header(self, capacity, tail, head, next_seq, acked):
+        """
+        Writes the journal header along with its checksum.
+        """
+        HEADER.pack_into(self._mm, 0, MAGIC, capacity, tail, head, next_seq, acked, 0)
+        struct.pack_into("<I", self._mm, HEADER.size - 4, zlib.crc32(self._mm[:HEADER.size - 4]))
+
+    def _write(self, capacity, offset, data):
+        """
+        Copies data into the ring at an absolute offset, wrapping around the end of the record area.
+        """
+        pos = offset % capacity
+        first = min(len(data), capacity - pos)
+        self._mm[HEADER.size + pos:HEADER.size + pos + first] = data[:first]
+        self._mm[HEADER.size:HEADER.size + len(data) - first] = data[first:]
+
+    def _read(self, capacity, offset, length):
+        """
+        Copies data out of the ring at an absolute offset, wrapping around the end of the record area.
+        """
+        pos = offset % capacity
+        first = min(length, capacity - pos)
+        return self._mm[HEADER.size + pos:HEADER.size + pos + first] + self._mm[HEADER.size:HEADER.size + length - first]
+
+    def append(self, payload):
+        """
+        Appends a record to the journal, evicting the oldest records as needed.
+
+        Args:
+            payload (bytes): The serialized event.
+
+        Returns:
+            tuple: The sequence number and the absolute offset of the record, or None if the payload does not fit in the journal.
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = self._read_header()
+            if header is None:
+                self._reset(len(self._mm) - HEADER.size)
+                header = self._read_header()
+            capacity, tail, head, next_seq, acked = header
+
+            length = RECORD.size + len(payload)
+            if length > capacity:
+                return None
+
+            while head + length - tail > capacity:
+                tail += RECORD.size + RECORD.unpack(self._read(capacity, tail, RECORD.size))[0]
+            tail = min(tail, head)
+
+            self._write(capacity, head, RECORD.pack(len(payload), 0, zlib.crc32(payload), next_seq) + payload)
+            self._write_header(capacity, tail, head + length, next_seq + 1, acked)
+            return next_seq, head
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def discard(self, seq, offset):
+        """
+        Marks a record as not to be replayed.
+
+        Args:
+            seq (int): The sequence number returned by append().
+            offset (int): The offset returned by append().
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = self._read_header()
+            if header is None or offset < header[1]:
+                return
+            capacity = header[0]
+            length, flags, crc, record_seq = RECORD.unpack(self._read(capacity, offset, RECORD.size))
+            if record_seq == seq:
+                self._write(capacity, offset, RECORD.pack(length, flags | FLAG_DISCARDED, crc, seq))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def ack(self, seq):
+        """
+        Acknowledges every record up to a sequence number.
+
+        Args:
+            seq (int): The sequence number of the last processed record.
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = self._read_header()
+            if header is not None and seq > header[4]:
+                self._write_header(*header[:4], seq)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def records(self):
+        """
+        Returns the records retained in the journal, oldest first.
+
+        Records flagged as discarded are skipped and reading stops at the first corrupted record.
+
+        Returns:
+            tuple: The acknowledged sequence number and a list of (seq, payload) tuples.
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            header = self._read_header()
+            if header is None:
+                return 0, []
+            capacity, offset, head, next_seq, acked = header
+
+            records = []
+            while offset + RECORD.size <= head:
+                length, flags, crc, seq = RECORD.unpack(self._read(capacity, offset, RECORD.size))
+                if offset + RECORD.size + length > head:
+                    break
+                payload = self._read(capacity, offset + RECORD.size, length)
+                if zlib.crc32(payload) != crc:
+                    break
+                if not flags & FLAG_DISCARDED:
+                    records.append((seq, payload))
+                offset += RECORD.size + length
+            return acked, records
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+sys.path.insert(0, FILES_DIR)
+
+from onevent_fifo import frame, FRAGMENT_SIZE
+from meta_librespot import LineFramer, Reassembler, FRAGMENT_PREFIX
+
+def reassemble(lines, chunk=None):
+    """
+    Feeds framed lines through the plugin's framer and reassembler.
+
+    Args:
+        lines (list): The lines written by the hook, as bytes.
+        chunk (int): The size of the reads the data is split into, or None to feed it at once.
+
+    Returns:
+        list: The events received by the plugin, as str.
+    """
+    data = b"".join(lines)
+    chunk = chunk or len(data)
+    framer, reassembler, events = LineFramer(), Reassembler(), []
+    for i in range(0, len(data), chunk):
+        for line in framer.feed(data[i:i + chunk]):
+            if line.startswith(FRAGMENT_PREFIX):
+                line = reassembler.feed(line)
+            if line is not None:
+                events.append(line)
+    return events
+
+def boundary_payload(char, offset):
+    """
+    Builds an event whose serialization has a character at a given offset from the first fragment boundary.
+
+    Args:
+        char (str): The character.
+        offset (int): The offset from the boundary, 0 for the last byte of the first fragment, 1 for the first byte of the second one.
+
+    Returns:
+        str: The JSON-serialized event.
+    """
+    head = '{"event": "track_changed", "name": "'
+    filler = "x" * (FRAGMENT_SIZE - len(head) - 1 + offset)
+    return json.dumps({"event": "track_changed", "name": filler + char + "x" * FRAGMENT_SIZE})
+
+def test_small_event_is_one_line():
+    payload = json.dumps({"event": "playing", "name": "  padded  "})
+    assert frame(payload) == [payload.encode() + b"\n"]
+    assert reassemble(frame(payload)) == [payload]
+
+def test_space_at_fragment_boundary():
+    for offset in (0, 1):
+        payload = boundary_payload(" ", offset)
+        lines = frame(payload)
+        assert len(lines) > 1
+        # The space is the last byte of a fragment, or the first byte of the next one
+        assert lines[0].endswith(b" \n") if offset == 0 else lines[1].split(b" ", 3)[3].startswith(b" ")
+        assert reassemble(lines) == [payload]
+        assert reassemble(lines, chunk=97) == [payload]
+
+def test_whitespace_only_fragment():
+    payload = boundary_payload(" " * FRAGMENT_SIZE, 1)
+    assert reassemble(frame(payload)) == [payload]
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
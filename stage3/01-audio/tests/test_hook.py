@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import select
+import tempfile
+import subprocess
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+sys.path.insert(0, FILES_DIR)
+
+from onevent_forwarder import parse
+
+TRACK_CHANGED = {
+    "PLAYER_EVENT": "track_changed", "ITEM_TYPE": "Track", "TRACK_ID": "4uLU6hMCjMI75M1A2tKUQC",
+    "URI": "spotify:track:4uLU6hMCjMI75M1A2tKUQC", "NAME": " Never  Gonna $(Give) You Up ", "DURATION_MS": "213573",
+    "IS_EXPLICIT": "false", "LANGUAGE": "en", "COVERS": "https://i.scdn.co/image/a\nhttps://i.scdn.co/image/b",
+    "NUMBER": "1", "DISC_NUMBER": "1", "POPULARITY": "78", "ALBUM": "", "ARTISTS": "Rick Astley", "ALBUM_ARTISTS": "Rick Astley"
+}
+
+def stage(directory, *modules):
+    """
+    Copies the hook, and the given modules next to it, to a directory.
+
+    Without onevent_fifo.py next to it, the hook cannot fall back to handling the event itself.
+
+    Args:
+        directory (str): The directory to copy the files to.
+        modules (str): The file names of the modules.
+
+    Returns:
+        str: The path of the hook.
+    """
+    for module in ("onevent_hook.sh",) + modules:
+        shutil.copy(os.path.join(FILES_DIR, module), directory)
+    return os.path.join(directory, "onevent_hook.sh")
+
+def run_hook(hook, env):
+    return subprocess.run(["/bin/sh", hook], env=dict(env, PATH="/usr/bin:/bin"), stdin=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=10)
+
+def read(fd, end, timeout=5):
+    """
+    Reads from a non-blocking pipe until the data read ends with a marker.
+    """
+    data = b""
+    deadline = time.monotonic() + timeout
+    while not data.endswith(end) and time.monotonic() < deadline:
+        if select.select([fd], [], [], 0.1)[0]:
+            data += os.read(fd, 65536)
+    return data
+
+def test_hook_writes_to_the_forwarder():
+    with tempfile.TemporaryDirectory() as directory:
+        hook = stage(directory)
+        fifo = os.path.join(directory, "events")
+        os.mkfifo(fifo)
+        fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            for shell in ("dash", "bash"):
+                if shutil.which(shell) is None:
+                    continue
+                result = subprocess.run([shell, hook], env=dict(TRACK_CHANGED, ONEVENT_FORWARDER=fifo), stderr=subprocess.PIPE, timeout=10)
+                # The hook could not have fallen back to onevent_fifo.py, which is not next to it
+                assert result.returncode == 0, result.stderr
+                record = read(fd, b"\0\0")
+                assert record.endswith(b"\0\0") and record.count(b"\0\0") == 1
+                assert parse(record[:-2]) == TRACK_CHANGED
+        finally:
+            os.close(fd)
+
+def test_hook_falls_back_without_forwarder():
+    with tempfile.TemporaryDirectory() as directory:
+        hook = stage(directory, "onevent_fifo.py", "onevent_journal.py")
+        fifo = os.path.join(directory, "spotfifo")
+        os.mkfifo(fifo)
+        fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            env = dict(TRACK_CHANGED, ONEVENT_FORWARDER=os.path.join(directory, "none"), ONEVENT_FIFO=fifo,
+                       ONEVENT_JOURNAL=os.path.join(directory, "journal"))
+            result = run_hook(hook, env)
+            assert result.returncode == 0, result.stderr
+            event = json.loads(read(fd, b"\n"))
+            assert event["event"] == "track_changed" and event["name"] == TRACK_CHANGED["NAME"]
+        finally:
+            os.close(fd)
+
+def test_large_event_falls_back():
+    with tempfile.TemporaryDirectory() as directory:
+        hook = stage(directory, "onevent_fifo.py", "onevent_journal.py")
+        hook_fifo = os.path.join(directory, "events")
+        fifo = os.path.join(directory, "spotfifo")
+        os.mkfifo(hook_fifo)
+        os.mkfifo(fifo)
+        hook_fd = os.open(hook_fifo, os.O_RDWR | os.O_NONBLOCK)
+        fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            # Larger than PIPE_BUF, the record could interleave with the records of concurrent hooks
+            env = dict(TRACK_CHANGED, ARTISTS="Rick Astley\n" * 400, ONEVENT_FORWARDER=hook_fifo, ONEVENT_FIFO=fifo,
+                       ONEVENT_JOURNAL=os.path.join(directory, "journal"))
+            result = run_hook(hook, env)
+            assert result.returncode == 0, result.stderr
+            # onevent_fifo.py handled it, and split it into fragments
+            assert read(fd, b"\n").startswith(b"~")
+            assert read(hook_fd, b"\0\0", timeout=0) == b""
+        finally:
+            os.close(hook_fd)
+            os.close(fd)
+
+def test_forwarder_sends_hook_events():
+    with tempfile.TemporaryDirectory() as directory:
+        hook = stage(directory)
+        hook_fifo = os.path.join(directory, "events")
+        fifo = os.path.join(directory, "spotfifo")
+        os.mkfifo(fifo)
+        fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+        forwarder = subprocess.Popen([sys.executable, os.path.join(FILES_DIR, "onevent_forwarder.py"), "--hook-fifo", hook_fifo,
+                                      "--librespot-fifo", fifo, "--librespot-journal", os.path.join(directory, "journal")])
+        try:
+            deadline = time.monotonic() + 5
+            while not os.path.exists(hook_fifo) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            result = run_hook(hook, dict(TRACK_CHANGED, ONEVENT_FORWARDER=hook_fifo))
+            assert result.returncode == 0, result.stderr
+            event = json.loads(read(fd, b"\n"))
+            assert event["event"] == "track_changed" and event["covers"] == TRACK_CHANGED["COVERS"].split("\n")
+        finally:
+            forwarder.terminate()
+            forwarder.wait()
+            os.close(fd)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+sys.path.insert(0, FILES_DIR)
+
+import meta_librespot
+
+def playing_control(sent):
+    """
+    Creates a plugin that plays from the start of a track and records the notifications it sends.
+
+    Args:
+        sent (list): The list the sent notifications are appended to.
+
+    Returns:
+        tuple: The plugin and the CLOCK_MONOTONIC time at which the playback started, in nanoseconds.
+    """
+    meta_librespot.send = sent.append
+    control = meta_librespot.LibrespotControl()
+    start = time.clock_gettime_ns(time.CLOCK_MONOTONIC) - 60 * 10**9
+    control._update_state("playing", start)
+    control._update_position(0, start)
+    control._send_properties()
+    return control, start
+
+def test_seek_to_the_same_position_is_notified():
+    sent = []
+    control, start = playing_control(sent)
+
+    # Restarting the track 30 s later anchors the clock on the same position, on another timeline
+    control._update_position(0, start + 30 * 10**9)
+    control._send_properties()
+    assert len(sent) == 2
+    assert sent[-1]["params"]["position"] < 31
+
+def test_correction_on_the_same_timeline_is_suppressed():
+    sent = []
+    control, start = playing_control(sent)
+
+    control._update_position(30000, start + 30 * 10**9)
+    control._update_state("playing", start + 40 * 10**9)
+    control._send_properties()
+    assert len(sent) == 1
+
+def test_pause_is_notified_once():
+    sent = []
+    control, start = playing_control(sent)
+
+    control._update_state("paused", start + 30 * 10**9)
+    control._send_properties()
+    control._update_state("paused", start + 40 * 10**9)
+    control._send_properties()
+    assert len(sent) == 2
+    assert sent[-1]["params"]["position"] == 30.0
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+sys.path.insert(0, FILES_DIR)
+
+import meta_librespot
+from meta_cache import MetadataCache
+from onevent_journal import Journal
+
+def track_changed(track_id):
+    return {"event": "track_changed", "track_id": track_id, "uri": f"spotify:track:{track_id}", "name": track_id,
+            "duration_ms": 180000, "album": "Album", "artists": ["Artist"], "album_artists": ["Artist"], "covers": []}
+
+def replay(events):
+    """
+    Replays journaled events into a plugin whose metadata lookups are recorded instead of sent to Spotify.
+
+    Args:
+        events (list): The journaled events.
+
+    Returns:
+        tuple: The plugin and the (kind, item ID) of the lookups it started.
+    """
+    lookups = []
+
+    async def lookup(kind, item_id):
+        lookups.append((kind, item_id))
+
+    async def main():
+        with tempfile.TemporaryDirectory() as directory:
+            meta_librespot.params["librespot_fifo"] = os.path.join(directory, "fifo")
+            meta_librespot.params["librespot_journal"] = os.path.join(directory, "journal")
+            journal = Journal(meta_librespot.params["librespot_journal"])
+            for event in events:
+                journal.append(json.dumps(event).encode())
+            journal.close()
+
+            control = meta_librespot.LibrespotControl()
+            control._loop = asyncio.get_running_loop()
+            control._cache = MetadataCache(None)
+            control._lookup = lookup
+            control._replay_journal()
+            await asyncio.sleep(0)
+            return control
+
+    meta_librespot.send = lambda msg: None
+    return asyncio.run(main()), lookups
+
+def test_only_the_current_item_is_enriched():
+    control, lookups = replay([track_changed(f"T{i}") for i in range(20)])
+    assert lookups == [("track", "T19")]
+    assert control._properties["metadata"]["trackId"] == "T19"
+
+def test_only_the_last_preload_is_prefetched():
+    events = []
+    for i in range(20):
+        events += [{"event": "preload_next", "track_id": f"T{i}"}, track_changed(f"T{i}")]
+    control, lookups = replay(events + [{"event": "preload_next", "track_id": "T20"}])
+    assert lookups == [("track", "T19"), ("track", "T20")]
+    assert control._prefetched == "T20"
+    assert control._prefetches["unused"] == 0
+
+def test_a_consumed_preload_is_not_prefetched():
+    control, lookups = replay([{"event": "preload_next", "track_id": "T1"}, track_changed("T1")])
+    assert lookups == [("track", "T1")]
+    assert control._prefetched is None
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
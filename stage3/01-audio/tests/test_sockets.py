@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import select
+import tempfile
+import threading
+
+FILES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "files"))
+sys.path.insert(0, FILES_DIR)
+
+import onevent_fifo
+import meta_librespot
+from onevent_bus import Listener, Subscriber
+
+# Larger than the default send buffer of a Unix socket (net.core.wmem_default), with whitespace around the fragment boundaries
+LARGE_EVENT = {"event": "track_changed", "name": "x  " * 150000}
+
+def send(endpoint, directory, event):
+    """
+    Sends an event with the hook module, as librespot would, from another thread.
+
+    Args:
+        endpoint (str): The endpoint to send the event to.
+        directory (str): The directory of the journal.
+        event (dict): The event.
+
+    Returns:
+        threading.Thread: The thread sending the event.
+    """
+    onevent_fifo.FIFO_PATH = endpoint
+    onevent_fifo.JOURNAL_PATH = os.path.join(directory, "journal")
+    onevent_fifo.SEND_TIMEOUT = 5
+    thread = threading.Thread(target=onevent_fifo.send, args=(dict(event),))
+    thread.start()
+    return thread
+
+def receive(receiver, control, count, timeout=5):
+    """
+    Receives events the way the plugin does, until a number of them were reassembled.
+
+    Args:
+        receiver (Listener | Subscriber): The socket the events are received on.
+        control (meta_librespot.LibrespotControl): The plugin.
+        count (int): The number of events to receive.
+
+    Returns:
+        list: The received events.
+    """
+    events = []
+    reassembler = meta_librespot.Reassembler()
+
+    def handle(messages):
+        for message in messages:
+            if message.startswith(meta_librespot.FRAGMENT_PREFIX):
+                message = reassembler.feed(message)
+            if message is not None:
+                events.append(json.loads(message))
+
+    control._on_fifo_batch = handle
+    while len(events) < count and select.select([receiver], [], [], timeout)[0]:
+        control._on_receiver_readable(receiver)
+    return events
+
+def test_large_event_is_fragmented_on_sockets():
+    control = meta_librespot.LibrespotControl()
+    for kind in ("dgram", "seqpacket"):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "spotfifo.sock")
+            listener = Listener(kind, path)
+            try:
+                thread = send(f"{kind}:{path}", directory, LARGE_EVENT)
+                events = receive(listener, control, 1)
+                thread.join()
+            finally:
+                listener.close()
+            assert len(events) == 1
+            assert events[0]["name"] == LARGE_EVENT["name"]
+
+def test_small_event_is_one_message():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "spotfifo.sock")
+        listener = Listener("dgram", path)
+        try:
+            thread = send(f"dgram:{path}", directory, {"event": "volume_changed", "volume": 50})
+            thread.join()
+            messages = listener.recv()
+        finally:
+            listener.close()
+        assert len(messages) == 1 and json.loads(messages[0])["volume"] == 50
+
+def test_large_event_is_not_published_on_the_bus():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "spotbus")
+        subscriber = Subscriber("test", path)
+        onevent_fifo.FIFO_PATH = f"bus:{path}"
+        try:
+            assert onevent_fifo.publish_event(path, json.dumps(LARGE_EVENT)) == (0, 1)
+            assert subscriber.recv() == []
+        finally:
+            subscriber.close()
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")